@@ -19,29 +19,37 @@ email                : motta.luiz@gmail.com
  ***************************************************************************/
 """
 
-from PyQt4.QtGui import ( QAction, QIcon )
+from PyQt4.QtGui import ( QAction, QIcon, QFileDialog )
 from PyQt4.QtCore import pyqtSlot
 
 from qgis.core import ( QgsProject )
 
 import os
 
-from auxiliarywindow import ContainerAuxiliaryWindow
-
 def classFactory(iface):
   return AuxiliaryWindowPlugin( iface )
 
 class AuxiliaryWindowPlugin:
 
+  # Same of ContainerAuxiliaryWindow, the project is read without import the module
+  pluginName = "Plugin_Auxiliary_Window"
+  pluginSetting = "/windowsSetting"
+
   def __init__(self, iface):
     self.iface = iface
-    self.plugin = ContainerAuxiliaryWindow( iface.mainWindow() )
+    self.plugin = None # ContainerAuxiliaryWindow, created by first use
     self.namePlugin = "&Auxiliary Window"
 
+  def _container(self):
+    if self.plugin is None:
+      from auxiliarywindow import ContainerAuxiliaryWindow
+      self.plugin = ContainerAuxiliaryWindow( self.iface.mainWindow() )
+    return self.plugin
+
   def _connect(self, isConnect = True):
     signal_slot = (
-      { 'signal': QgsProject.instance().readProject, 'slot': self.plugin.onReadProject },
-      { 'signal': QgsProject.instance().writeProject, 'slot': self.plugin.onWriteProject }
+      { 'signal': QgsProject.instance().readProject, 'slot': self.onReadProject },
+      { 'signal': QgsProject.instance().writeProject, 'slot': self.onWriteProject }
     )
     if isConnect:
       for item in signal_slot:
@@ -60,15 +68,77 @@ class AuxiliaryWindowPlugin:
     self.action.triggered.connect( self.run )
     self.iface.addToolBarIcon( self.action )
     self.iface.addPluginToMenu( self.namePlugin, self.action)
+    title = "Report of windows"
+    self.actionReport = QAction( QIcon(), title, self.iface.mainWindow() )
+    self.actionReport.setObjectName( "AuxiliaryWindowReport" )
+    self.actionReport.setStatusTip( "Live windows, layers, connections and memory of render caches" )
+    self.actionReport.triggered.connect( self.report )
+    self.iface.addPluginToMenu( self.namePlugin, self.actionReport)
+    title = "Record trace of events"
+    self.actionTrace = QAction( QIcon(), title, self.iface.mainWindow() )
+    self.actionTrace.setObjectName( "AuxiliaryWindowTrace" )
+    self.actionTrace.setStatusTip( "Record the events of main map and windows, for replay" )
+    self.actionTrace.setCheckable( True )
+    self.actionTrace.toggled.connect( self.trace )
+    self.iface.addPluginToMenu( self.namePlugin, self.actionTrace)
+    title = "Export windows to images"
+    self.actionExport = QAction( QIcon(), title, self.iface.mainWindow() )
+    self.actionExport.setObjectName( "AuxiliaryWindowExport" )
+    self.actionExport.setStatusTip( "Images(300 dpi) of all windows, with extent of main map if checked" )
+    self.actionExport.triggered.connect( self.export )
+    self.iface.addPluginToMenu( self.namePlugin, self.actionExport)
     self._connect()
 
   def unload(self):
     self.iface.removeToolBarIcon( self.action )
     self.iface.removePluginMenu( self.namePlugin, self.action)
+    self.iface.removePluginMenu( self.namePlugin, self.actionReport)
+    self.iface.removePluginMenu( self.namePlugin, self.actionTrace)
+    self.iface.removePluginMenu( self.namePlugin, self.actionExport)
     del self.action
+    del self.actionReport
+    del self.actionTrace
+    del self.actionExport
     self._connect( False )
-    self.plugin.close()
+    if not self.plugin is None:
+      self.plugin.stopTrace()
+      self.plugin.close()
+
+  @pyqtSlot("QDomDocument")
+  def onReadProject(self, document):
+    if self.plugin is None:
+      value, ok = QgsProject.instance().readEntry( self.pluginName, self.pluginSetting )
+      if not ok or not bool( value ):
+        return # Project without windows
+    self._container().onReadProject( document )
+
+  @pyqtSlot("QDomDocument")
+  def onWriteProject(self, document):
+    if not self.plugin is None: # Without container, no windows
+      self.plugin.onWriteProject( document )
   
   @pyqtSlot()
   def run(self):
-    self.plugin.run()
+    self._container().run()
+
+  @pyqtSlot()
+  def report(self):
+    self._container().logReport()
+
+  @pyqtSlot(bool)
+  def trace(self, enabled):
+    if not enabled:
+      if not self.plugin is None:
+        self.plugin.stopTrace()
+      return
+    filename = QFileDialog.getSaveFileName( self.iface.mainWindow(), "Record trace of events", "", "Trace (*.trace.gz)" )
+    if not filename:
+      self.actionTrace.setChecked( False )
+      return
+    self._container().startTrace( filename )
+
+  @pyqtSlot()
+  def export(self):
+    directory = QFileDialog.getExistingDirectory( self.iface.mainWindow(), "Export windows to images" )
+    if directory:
+      self._container().exportImages( directory )
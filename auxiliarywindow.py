@@ -19,21 +19,101 @@ email                : motta.luiz@gmail.com
  ***************************************************************************/
 """
 
-from PyQt4.QtGui import ( QMainWindow, QWidget, QGridLayout, QSizePolicy, QDockWidget,
-                          QIcon, QColor, QAbstractItemView,
-                          QToolBar, QToolButton, QCheckBox, QLabel, QDoubleSpinBox, QAction )
-from PyQt4.QtCore import ( Qt, QRect, QTimer, pyqtSlot, pyqtSignal )
+from PyQt4.QtGui import ( QApplication, QMainWindow, QWidget, QGridLayout, QSizePolicy, QDockWidget,
+                          QHBoxLayout, QVBoxLayout, QIcon, QColor, QPen, QAbstractItemView,
+                          QTableWidget, QTableWidgetItem, QPushButton, QFileDialog,
+                          QToolBar, QToolButton, QCheckBox, QComboBox, QLabel, QDoubleSpinBox, QAction,
+                          QPainter, QMenu )
+from PyQt4.QtCore import ( Qt, QEvent, QObject, QRect, QRectF, QLineF, QSize, QTimer, QThread,
+                           pyqtSlot, pyqtSignal )
 
 import qgis
-from qgis.gui import  ( QgsRubberBand, QgsLayerTreeMapCanvasBridge, QgsLayerTreeView,
-                        QgsMapCanvas, QgsMapToolPan,
-                        QgsVertexMarker, QgsMessageBar )
-from qgis.core import ( QGis, QgsMapLayerRegistry, QgsProject, QgsLayerTreeModel, QgsLayerTreeGroup,
-                        QgsVectorLayer, QgsGeometry, QgsRectangle, QgsPoint )
-
+from qgis.gui import  ( QgsRubberBand, QgsGenericProjectionSelector, QgsLayerTreeMapCanvasBridge, QgsLayerTreeView,
+                        QgsMapCanvas, QgsMapCanvasItem, QgsMapToolPan, QgsMessageBar )
+from qgis.core import ( QGis, QgsMessageLog, QgsMapLayerRegistry, QgsProject, QgsLayerTreeModel, QgsLayerTreeGroup,
+                        QgsMapSettings, QgsMapRendererParallelJob,
+                        QgsVectorLayer, QgsFeatureRequest, QgsGeometry, QgsRectangle, QgsPoint,
+                        QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsCsException )
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial, wraps
+import bisect
+import gzip
 import locale
+import math
 import os
 import json
+import time
+
+
+class HotPathStats():
+  """
+  Counters and histograms of time(milliseconds) of slots and renders of one window.
+  """
+  bounds = ( 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000 ) # Upper of buckets, last is overflow
+
+  def __init__(self):
+    self.reset()
+
+  def reset(self):
+    self.counters = {} # name: total
+    self.histograms = {} # name: { 'counts', 'total', 'max' }
+
+  def count(self, name, value=1):
+    self.counters[ name ] = self.counters.get( name, 0 ) + value
+
+  def addTime(self, name, ms):
+    h = self.histograms.get( name )
+    if h is None:
+      h = self.histograms[ name ] = { 'counts': [ 0 ] * ( len( self.bounds ) + 1 ), 'total': 0.0, 'max': 0.0 }
+    h['counts'][ bisect.bisect_left( self.bounds, ms ) ] += 1
+    h['total'] += ms
+    h['max'] = max( h['max'], ms )
+
+  def rows(self):
+    """ Return [ ( name, count, total, mean, max ) ], the time of counters without histogram is None """
+    rows = []
+    for name in sorted( set( self.counters.keys() ) | set( self.histograms.keys() ) ):
+      h = self.histograms.get( name )
+      if h is None:
+        rows.append( ( name, self.counters[ name ], None, None, None ) )
+      else:
+        total = sum( h['counts'] )
+        rows.append( ( name, self.counters.get( name, total ), h['total'], h['total'] / total, h['max'] ) )
+    return rows
+
+  def toJson(self):
+    return json.dumps( { 'bounds': self.bounds, 'counters': self.counters, 'histograms': self.histograms }, indent=2 )
+
+  def toCsv(self):
+    header = [ 'name', 'count', 'total_ms', 'mean_ms', 'max_ms' ]
+    header += map( lambda item: "le_%d" % item, self.bounds ) + [ "gt_%d" % self.bounds[-1] ]
+    lines = [ ','.join( header ) ]
+    for row in self.rows():
+      h = self.histograms.get( row[0] )
+      counts = h['counts'] if not h is None else [ '' ] * ( len( self.bounds ) + 1 )
+      values = map( lambda item: '' if item is None else str( item ), row ) + map( str, counts )
+      lines.append( ','.join( values ) )
+    return '\n'.join( lines ) + '\n'
+
+
+def hotPath(name):
+  """
+  Decorator for count the calls and the time of method.
+  The object of method needs 'stats' (HotPathStats).
+  """
+  def decorator(func):
+    @wraps( func )
+    def wrapper(self, *args, **kwargs):
+      self.stats.count( name )
+      t0 = time.time()
+      try:
+        return func( self, *args, **kwargs )
+      finally:
+        self.stats.addTime( name, ( time.time() - t0 ) * 1000.0 )
+    return wrapper
+  return decorator
 
 
 class AuxiliaryLegend( QDockWidget ):
@@ -115,6 +195,7 @@ class AuxiliaryLegend( QDockWidget ):
     super( AuxiliaryLegend, self ).__init__( "#%d - Layers" % numWin, parent )
 
     ltg = parent.ltg    
+    self.auxWindow = parent
     self.tview = self.model = self.bridge = None
     self.textSync = "Sync with group(main map) for new layers"
     self.actSync = None
@@ -133,12 +214,20 @@ class AuxiliaryLegend( QDockWidget ):
     act.setIconText( text )
 
   def setBridge(self, canvas):
+    if not self.bridge is None:
+      return
     ltg = self.model.rootGroup() 
-    self.bridge = QgsLayerTreeMapCanvasBridge( ltg, canvas ) # Need wait populate ltg
+    self.bridge = QgsLayerTreeMapCanvasBridge( ltg, canvas )
+    # Without setup, ltg.addLayer(postponed trigger for adding layers) not change the extent of canvas
+    self.bridge.setAutoSetupOnFirstLayer( False )
 
-  def clearBridge(self):
+  def teardown(self):
+    """ Need before delete the window: the bridge is deleted now, the model with the tree view """
     if not self.bridge is None:
       self.bridge.clear()
+      self.bridge = None
+    self.model.setParent( self.tview )
+    self.model = None
 
   def closeEvent(self, event):
     event.accept()
@@ -154,14 +243,14 @@ class AuxiliaryLegend( QDockWidget ):
         self.needSelectLayer.emit()
         return
       
-      if nameSender in ( 'showLayer', 'hideLayer'):
-        checked = Qt.Checked if nameSender == 'showLayer' else Qt.Unchecked
-        map( lambda item: item.setVisible( checked ), nodes )
-      else:
-        ltg = self.model.rootGroup()
-        for node in nodes:
-          self.removeLayer.emit( node.layer() )
-          ltg.removeChildNode( node )
+      with self.auxWindow.layerTransaction() as ltg:
+        if nameSender in ( 'showLayer', 'hideLayer'):
+          checked = Qt.Checked if nameSender == 'showLayer' else Qt.Unchecked
+          map( lambda item: item.setVisible( checked ), nodes )
+        else:
+          for node in nodes:
+            self.removeLayer.emit( node.layer() )
+            ltg.removeChildNode( node )
 
     # addLayer, currentLayer
     else: 
@@ -173,53 +262,1290 @@ class AuxiliaryLegend( QDockWidget ):
         self.syncGroupLayer.emit()
 
 
-class MarkerWindow():
+class DiagnosticsDock( QDockWidget ):
+  """
+  Counters and times(HotPathStats) of window, exported as JSON or CSV.
+  """
+  def __init__( self, parent, numWin, stats ):
+    def addButton(text, slot):
+      w = QPushButton( text, widget )
+      w.clicked.connect( slot )
+      layoutButtons.addWidget( w )
+
+    super( DiagnosticsDock, self ).__init__( "#%d - Diagnostics" % numWin, parent )
+    self.stats = stats
+    self.setAllowedAreas( Qt.RightDockWidgetArea | Qt.LeftDockWidgetArea )
+
+    widget = QWidget( self )
+    self.table = QTableWidget( 0, 5, widget )
+    self.table.setHorizontalHeaderLabels( [ 'Name', 'Count', 'Total(ms)', 'Mean(ms)', 'Max(ms)' ] )
+    self.table.setEditTriggers( QAbstractItemView.NoEditTriggers )
+    layoutButtons = QHBoxLayout()
+    addButton( "Reset", self.onReset )
+    addButton( "Export JSON", lambda: self._export( 'json' ) )
+    addButton( "Export CSV", lambda: self._export( 'csv' ) )
+    layout = QVBoxLayout()
+    layout.setContentsMargins( 0, 0, 0, 0 )
+    layout.addWidget( self.table )
+    layout.addLayout( layoutButtons )
+    widget.setLayout( layout )
+    self.setWidget( widget )
+
+    self.timer = QTimer( self ) # Update while visible
+    self.timer.setInterval( 1000 )
+    self.timer.timeout.connect( self.populate )
+    self.visibilityChanged.connect( self.onVisibilityChanged )
+
+  def _export(self, format):
+    title = "Export diagnostics(%s)" % format.upper()
+    fileName = QFileDialog.getSaveFileName( self, title, "", "*.%s" % format )
+    if not fileName:
+      return
+    data = self.stats.toJson() if format == 'json' else self.stats.toCsv()
+    with open( fileName, 'w' ) as f:
+      f.write( data )
+
+  @pyqtSlot()
+  def populate(self):
+    def item(value):
+      text = value if isinstance( value, basestring ) else \
+             "" if value is None else \
+             str( value ) if isinstance( value, int ) else "%.2f" % value
+      return QTableWidgetItem( text )
+
+    rows = self.stats.rows()
+    self.table.setRowCount( len( rows ) )
+    for id in range( len( rows ) ):
+      for col in range( len( rows[ id ] ) ):
+        self.table.setItem( id, col, item( rows[ id ][ col ] ) )
+    self.table.resizeColumnsToContents()
+
+  @pyqtSlot()
+  def onReset(self):
+    self.stats.reset()
+    self.populate()
+
+  @pyqtSlot(bool)
+  def onVisibilityChanged(self, visible):
+    if visible:
+      self.populate()
+      self.timer.start()
+    else:
+      self.timer.stop()
+
+
+class CursorMarker( QgsMapCanvasItem ):
+  """
+  Cross with back(white) and front(red) colors painted by only one item of scene.
+  """
   def __init__(self, canvas):
-    self.canvas = canvas
-    self.markerBack = self.marker = None
+    super( CursorMarker, self ).__init__( canvas )
+    self.center = QgsPoint()
+    # ( pen, half size of cross )
+    self.crosses = (
+      ( QPen( QColor( 255, 255, 255 ), 4 ), 5 ),
+      ( QPen( QColor( 255, 0, 0 ), 2 ), 4 )
+    )
+    self.halfRect = max( map( lambda item: item[0].width() / 2.0 + item[1], self.crosses ) )
+
+  def setCenter(self, point):
+    self.center = point
+    self.setPos( self.toCanvasCoordinates( point ) )
+
+  def updatePosition(self):
+    self.setCenter( self.center )
+
+  def boundingRect(self):
+    s = self.halfRect
+    return QRectF( -s, -s, 2 * s, 2 * s )
+
+  def paint(self, painter, option=None, widget=None):
+    for pen, s in self.crosses:
+      painter.setPen( pen )
+      painter.drawLine( QLineF( -s, 0, s, 0 ) )
+      painter.drawLine( QLineF( 0, -s, 0, s ) )
+
+
+class ExtentItem( QgsMapCanvasItem ):
+  """
+  Rectangle(extent of main map) updated in place.
+  Changes are applied only when the rectangle is different, at most once by frame.
+  """
+  def __init__(self, canvas, interval=16):
+    super( ExtentItem, self ).__init__( canvas )
+    self.pen = QPen( QColor( 255, 0, 0 ), 2 )
+    self.pending = None
+    self.timer = QTimer( canvas )
+    self.timer.setSingleShot( True )
+    self.timer.setInterval( interval )
+    self.timer.timeout.connect( self.onTimeout )
+
+  def setExtent(self, rect):
+    if rect == self.rect() and self.pending is None:
+      return
+    self.pending = QgsRectangle( rect )
+    if not self.timer.isActive():
+      self.timer.start()
 
-  def add(self):
-    def createMarker( colorRGB, penWidth, iconSize, iconType ):
-      marker = QgsVertexMarker( self.canvas )
-      marker.setColor( QColor( colorRGB['R'], colorRGB['G'] , colorRGB['B'] ) )
-      marker.setPenWidth( penWidth )
-      marker.setIconSize( iconSize )
-      marker.setIconType( iconType )
+  def paint(self, painter, option=None, widget=None):
+    rect = self.rect()
+    topLeft = self.toCanvasCoordinates( QgsPoint( rect.xMinimum(), rect.yMaximum() ) ) - self.pos()
+    bottomRight = self.toCanvasCoordinates( QgsPoint( rect.xMaximum(), rect.yMinimum() ) ) - self.pos()
+    painter.setPen( self.pen )
+    painter.setBrush( Qt.NoBrush )
+    painter.drawRect( QRectF( topLeft, bottomRight ) )
 
-      return marker
+  def onTimeout(self):
+    rect, self.pending = self.pending, None
+    if not rect is None and rect != self.rect():
+      self.setRect( rect )
+      self.update()
 
-    if not self.markerBack is None:
-      self.canvas.scene().removeItem( self.markerBack )
+
+class MarkerWindow():
+  """
+  Cursor of main map in auxiliary canvas.
+  The position is sampled by rate(Hz), the cursor moves for each pixel in main map.
+  With own CRS of window, the point is transformed only by sample(onTimeout).
+  """
+  rates = ( 15, 30, 60 )
+
+  def __init__(self, canvas, stats, transforms, rate=30):
+    self.canvas = canvas
+    self.stats = stats
+    self.transforms = transforms # CrsTransforms
+    self.marker = self.point = None
+    self.crs = ( None, None ) # CRS of point and of window, None is same CRS
+    self.timer = QTimer( canvas )
+    self.timer.setSingleShot( True )
+    self.timer.timeout.connect( self.onTimeout )
+    self.setRate( rate )
+
+  def setRate(self, rate):
+    self.rate = rate
+    self.timer.setInterval( int( 1000.0 / rate ) )
+
+  def add(self):
     if not self.marker is None:
       self.canvas.scene().removeItem( self.marker )
+    self.marker = CursorMarker( self.canvas )
 
-    iconType = QgsVertexMarker.ICON_CROSS
-    colorRGB = { 'R': 255, 'G': 255, 'B': 255 }
-    self.markerBack = createMarker( colorRGB, 4, 10, QgsVertexMarker.ICON_CROSS )
-    colorRGB = { 'R': 255, 'G': 0, 'B': 0 }
-    self.marker = createMarker( colorRGB, 2, 8, QgsVertexMarker.ICON_CROSS )
-    
   def remove(self):
-    if not self.markerBack is None:
-      self.canvas.scene().removeItem( self.markerBack )
-      self.markerBack = None
+    self.timer.stop()
+    self.point = None
     if not self.marker is None:
       self.canvas.scene().removeItem( self.marker )
       self.marker = None
 
   @pyqtSlot('QgsPoint')
-  def onXYCoordinates(self, point ):
-    if not self.markerBack is None:
-      self.markerBack.setCenter( point )
-    if not self.marker is None:
-      self.marker.setCenter( point )
+  @hotPath('onXYCoordinates')
+  def onXYCoordinates(self, point, crsSource=None, crsDest=None ):
+    if self.marker is None:
+      return
+    self.point, self.crs = point, ( crsSource, crsDest )
+    if not self.timer.isActive():
+      self.timer.start()
+
+  @pyqtSlot()
+  @hotPath('markerMove')
+  def onTimeout(self):
+    point, self.point = self.point, None
+    if self.marker is None or point is None:
+      return
+    crsSource, crsDest = self.crs
+    if not crsDest is None:
+      point = self.transforms.point( point, crsSource, crsDest )
+      if point is None:
+        return
+    self.marker.setCenter( point )
+
+
+class CrsTransforms():
+  """
+  Coordinate transforms by pair of CRS, reused by all windows and events.
+  A transform is created only for a new pair(a CRS changed), the last maxTransforms are kept.
+  """
+  def __init__(self, maxTransforms=16):
+    self.maxTransforms = maxTransforms
+    self.transforms = OrderedDict() # ( key of source, key of destination ): QgsCoordinateTransform
+
+  @staticmethod
+  def key(crs):
+    return crs.authid() or crs.toProj4()
+
+  def get(self, crsSource, crsDest):
+    """ Return None for same CRS """
+    key = ( self.key( crsSource ), self.key( crsDest ) )
+    if key[0] == key[1]:
+      return None
+    ct = self.transforms.pop( key, None )
+    if ct is None:
+      ct = QgsCoordinateTransform( crsSource, crsDest )
+      while len( self.transforms ) >= self.maxTransforms:
+        self.transforms.popitem( last=False )
+    self.transforms[ key ] = ct # Recently used
+    return ct
+
+  def point(self, point, crsSource, crsDest):
+    """ Return None if the point can not be transformed """
+    ct = self.get( crsSource, crsDest )
+    if ct is None:
+      return point
+    try:
+      return ct.transform( point )
+    except QgsCsException:
+      return None
+
+  def rect(self, rect, crsSource, crsDest):
+    """ Return None if the rectangle can not be transformed """
+    ct = self.get( crsSource, crsDest )
+    if ct is None:
+      return rect
+    try:
+      return ct.transformBoundingBox( rect )
+    except QgsCsException:
+      return None
+
+
+class QgisCanvasState():
+  """
+  Values of main map shared by all windows for one event.
+  Each value is calculated only once, when the first window needs it,
+  the extent is transformed once for each CRS of windows.
+  """
+  def __init__(self, canvas, transforms):
+    self.canvas, self.transforms = canvas, transforms
+    self._extent = self._scale = self._crs = None
+    self._extents = {} # Key of CRS: extent
+    self._scaleTexts = {}
+
+  def crs(self):
+    if self._crs is None:
+      self._crs = self.canvas.mapSettings().destinationCrs()
+    return self._crs
+
+  def extent(self, crs=None):
+    """ crs: None is the CRS of main map. Return None if can not be transformed to crs """
+    if self._extent is None:
+      self._extent = self.canvas.extent()
+    if crs is None:
+      return self._extent
+    key = CrsTransforms.key( crs )
+    if not key in self._extents:
+      self._extents[ key ] = self.transforms.rect( self._extent, self.crs(), crs )
+    return self._extents[ key ]
+
+  def scale(self):
+    if self._scale is None:
+      self._scale = self.canvas.scale()
+    return self._scale
+
+  def scaleText(self, scaleFactor):
+    if not scaleFactor in self._scaleTexts:
+      scale = locale.format( "%.0f", scaleFactor * self.scale(), True )
+      self._scaleTexts[ scaleFactor ] = "Scale 1:%s" % scale
+    return self._scaleTexts[ scaleFactor ]
+
+
+class SyncGraph():
+  """
+  Links of extent: each window follows the main map(None) or other window, the link has the
+  scale factor of window(scale of window / scale of followed map).
+  All canvas of graph have the same center, the scale of window is the scale of main map
+  by the factors of links from main map.
+  Guards, without disconnect of signals:
+    applying: canvas changed by graph, its extentsChanged is ignored
+    generation: number of each change, a window ignores a sync older than the last applied
+  Windows with own CRS are synchronized by the transforms of graph.
+  """
+  def __init__(self):
+    self.sources = {} # win: followed window or None(main map)
+    self.transforms = CrsTransforms()
+    self.generation = 0
+    self.applying = set() # Canvas
+
+  def add(self, win, source=None):
+    self.sources[ win ] = source
+
+  def remove(self, win):
+    # Followers of win follow its source, with the same scale
+    source = self.sources.pop( win, None )
+    factor = win.widgets['scaleFactorSpin'].value()
+    for item in self.followers( win ):
+      self.sources[ item ] = source
+      item.setScaleFactor( factor * item.widgets['scaleFactorSpin'].value() )
+
+  def followers(self, win):
+    return [ item for item, source in self.sources.items() if source is win ]
+
+  def canFollow(self, win, source):
+    # Without cycle
+    while not source is None:
+      if source is win:
+        return False
+      source = self.sources.get( source )
+    return True
+
+  def setSource(self, win, source):
+    if not win in self.sources or not self.canFollow( win, source ):
+      return False
+    self.sources[ win ] = source
+    return True
+
+  def factor(self, win):
+    """ Scale factor from main map, win None is the main map """
+    factor = 1.0
+    while not win is None:
+      factor *= win.widgets['scaleFactorSpin'].value()
+      win = self.sources.get( win )
+    return factor
+
+  def nextGeneration(self):
+    self.generation += 1
+    return self.generation
+
+  def isApplying(self, canvas):
+    return canvas in self.applying
+
+  @contextmanager
+  def apply(self, canvas):
+    """
+    Usage:
+      with self.syncGraph.apply( canvas ):
+        canvas.setExtent( extent )
+    """
+    self.applying.add( canvas )
+    try:
+      yield canvas
+    finally:
+      self.applying.discard( canvas )
+
+  def propagate(self, origin, qgisCanvas, generation=None):
+    """ Change of main map(origin is None) or window(origin), for the others windows """
+    if generation is None:
+      generation = self.nextGeneration()
+    state = QgisCanvasState( qgisCanvas, self.transforms )
+    for win in self.sources.keys():
+      if not win is origin:
+        win.onExtentsChangedQgisCanvas( state, generation )
+
+
+class SyncScheduler( QObject ):
+  """
+  Collapse a burst of extent changes in one synchronization by event loop tick.
+  Only the last scheduled function is executed, a render of canvas still running
+  is cancelled when a newer extent arrives.
+  """
+  def __init__(self, parent, canvas, interval=0):
+    super( SyncScheduler, self ).__init__( parent )
+    self.canvas = canvas
+    self.func = None
+    self.timer = QTimer( self )
+    self.timer.setSingleShot( True )
+    self.timer.setInterval( interval )
+    self.timer.timeout.connect( self.onTimeout )
+
+  def schedule(self, func, cancelRender=True):
+    self.func = func
+    if cancelRender and self.canvas.isDrawing():
+      self.canvas.stopRendering()
+    if not self.timer.isActive():
+      self.timer.start()
+
+  def cancel(self):
+    self.timer.stop()
+    self.func = None
+
+  @pyqtSlot()
+  def onTimeout(self):
+    func, self.func = self.func, None
+    if not func is None:
+      func()
+
+
+class MapImageItem( QgsMapCanvasItem ):
+  """
+  Images of map(rendered outside of canvas) painted over the last render of canvas,
+  each image is painted in its map rectangle.
+  """
+  def __init__(self, canvas):
+    super( MapImageItem, self ).__init__( canvas )
+    self.canvas = canvas
+    self.patches = [] # ( QImage, QgsRectangle )
+    self.setZValue( -5 ) # Below of others items of canvas
+    self.hide()
+
+  def setPatches(self, patches):
+    self.patches = patches
+    self.setVisible( len( patches ) > 0 )
+    self.update()
+
+  def clear(self):
+    self.setPatches( [] )
+
+  def updatePosition(self):
+    self.update()
+
+  def boundingRect(self):
+    return QRectF( 0, 0, self.canvas.width(), self.canvas.height() )
+
+  def paint(self, painter, option=None, widget=None):
+    for image, rect in self.patches:
+      topLeft = self.toCanvasCoordinates( QgsPoint( rect.xMinimum(), rect.yMaximum() ) )
+      bottomRight = self.toCanvasCoordinates( QgsPoint( rect.xMaximum(), rect.yMinimum() ) )
+      painter.drawImage( QRectF( topLeft, bottomRight ), image )
+
+
+class TilePrefetcher( QObject ):
+  """
+  Render, in background, a ring of tiles around the extent of canvas.
+  The tiles in direction of last pans are rendered first and kept in LRU cache,
+  the cached tiles are shown(MapImageItem) while canvas renders a new extent.
+  The jobs are in render budget(RenderBudget), paused while main map or windows render.
+  """
+  tileSize = 512 # Pixels
+  ring = 1 # Tiles around the extent of canvas
+
+  def __init__(self, parent, canvas, renderBudget, maxTiles=24, maxJobs=2):
+    super( TilePrefetcher, self ).__init__( parent )
+    self.canvas, self.renderBudget = canvas, renderBudget
+    self.maxTiles, self.maxJobs = maxTiles, maxJobs
+    self.tiles = OrderedDict() # key: QImage
+    self.jobs = {} # key: ( QgsMapRendererParallelJob, QgsRectangle )
+    self.queue = [] # ( key, QgsRectangle )
+    self.layers = {} # id: QgsMapLayer, for invalidate tiles
+    self.direction = ( 0.0, 0.0 )
+    self.center = None
+    self.item = MapImageItem( canvas )
+    self.canvas.mapCanvasRefreshed.connect( self.onMapCanvasRefreshed )
+    self.renderBudget.jobsAvailable.connect( self.onJobsAvailable )
+
+  def _signature(self):
+    settings = self.canvas.mapSettings()
+    mupp = float( "%.6g" % settings.mapUnitsPerPixel() )
+    crs = settings.destinationCrs().authid()
+    ids = tuple( map( lambda item: item.id(), self.canvas.layers() ) )
+    return ( mupp, crs, ids )
+
+  def _tiles(self, signature, extent, ring):
+    sizeTile = signature[0] * self.tileSize
+    ix1 = int( math.floor( extent.xMinimum() / sizeTile ) ) - ring
+    ix2 = int( math.floor( extent.xMaximum() / sizeTile ) ) + ring
+    iy1 = int( math.floor( extent.yMinimum() / sizeTile ) ) - ring
+    iy2 = int( math.floor( extent.yMaximum() / sizeTile ) ) + ring
+    tiles = []
+    for ix in range( ix1, ix2 + 1 ):
+      for iy in range( iy1, iy2 + 1 ):
+        rect = QgsRectangle( ix * sizeTile, iy * sizeTile, ( ix + 1 ) * sizeTile, ( iy + 1 ) * sizeTile )
+        tiles.append( ( signature + ( ix, iy ), rect ) )
+    return tiles
+
+  def _updateDirection(self, extent):
+    center = extent.center()
+    if not self.center is None:
+      dx, dy = center.x() - self.center.x(), center.y() - self.center.y()
+      length = math.hypot( dx, dy )
+      if length > 0:
+        # Weighted with previous direction
+        self.direction = ( 0.5 * self.direction[0] + 0.5 * dx / length,
+                           0.5 * self.direction[1] + 0.5 * dy / length )
+    self.center = center
+
+  def _updateLayers(self):
+    layers = dict( map( lambda item: ( item.id(), item ), self.canvas.layers() ) )
+    for id in set( self.layers.keys() ) - set( layers.keys() ):
+      self.layers[ id ].repaintRequested.disconnect( self.clear )
+    for id in set( layers.keys() ) - set( self.layers.keys() ):
+      layers[ id ].repaintRequested.connect( self.clear )
+    self.layers = layers
+
+  def _addTile(self, key, image):
+    self.tiles[ key ] = image
+    while len( self.tiles ) > self.maxTiles:
+      self.tiles.popitem( last=False )
+
+  def _startJobs(self):
+    if self.canvas.isDrawing() or not self.canvas.renderFlag():
+      return # Canvas has priority, restart when refreshed
+    while len( self.jobs ) < self.maxJobs and len( self.queue ) > 0:
+      key, rect = self.queue[0]
+      if key in self.tiles or key in self.jobs:
+        self.queue.pop( 0 )
+        continue
+      if not self.renderBudget.acquireJob( ( self, key ), self._pauseJob ):
+        return # Restart by jobsAvailable
+      self.queue.pop( 0 )
+      settings = QgsMapSettings( self.canvas.mapSettings() )
+      settings.setOutputSize( QSize( self.tileSize, self.tileSize ) )
+      settings.setExtent( rect )
+      job = QgsMapRendererParallelJob( settings )
+      job.setParent( self ) # Deleted by deleteLater, not by Python in finished
+      job.finished.connect( partial( self.onFinishedJob, key ) )
+      self.jobs[ key ] = ( job, rect )
+      job.start()
+
+  def _pauseJob(self, token):
+    # RenderBudget, the tile is rendered again after
+    key = token[1]
+    value = self.jobs.pop( key, None )
+    if value is None:
+      return
+    job, rect = value
+    job.cancel()
+    job.deleteLater()
+    self.queue.insert( 0, ( key, rect ) )
+
+  def showCached(self):
+    """ Show the cached tiles for current extent of canvas, need call before the render """
+    extent = self.canvas.extent()
+    self._updateDirection( extent )
+    self._updateLayers()
+    patches = []
+    for key, rect in self._tiles( self._signature(), extent, 0 ):
+      image = self.tiles.get( key )
+      if not image is None:
+        self.tiles[ key ] = self.tiles.pop( key ) # Recently used
+        patches.append( ( image, rect ) )
+    self.item.setPatches( patches )
+
+  def prefetch(self):
+    extent = self.canvas.extent()
+    center = extent.center()
+    def weight(tile):
+      c = tile[1].center()
+      dx, dy = c.x() - center.x(), c.y() - center.y()
+      length = math.hypot( dx, dy ) or 1.0
+      return ( dx * self.direction[0] + dy * self.direction[1] ) / length
+
+    tiles = [ item for item in self._tiles( self._signature(), extent, self.ring )
+              if not item[0] in self.tiles and not extent.contains( item[1] ) ]
+    tiles.sort( key=weight, reverse=True )
+    self.queue = tiles[ : self.maxTiles ]
+    self._startJobs()
+
+  @pyqtSlot()
+  def clear(self):
+    self.tiles.clear()
+    self.queue = []
+    self.item.clear()
+
+  def close(self):
+    self.clear()
+    for layer in self.layers.values():
+      layer.repaintRequested.disconnect( self.clear )
+    self.layers = {}
+    jobs, self.jobs = self.jobs, {}
+    for key, value in jobs.items():
+      self.renderBudget.releaseJob( ( self, key ) )
+      value[0].cancel()
+      value[0].deleteLater()
+    self.canvas.mapCanvasRefreshed.disconnect( self.onMapCanvasRefreshed )
+    self.renderBudget.jobsAvailable.disconnect( self.onJobsAvailable )
+    self.canvas.scene().removeItem( self.item )
+
+  @pyqtSlot()
+  def onMapCanvasRefreshed(self):
+    self.item.clear()
+    self.prefetch()
+
+  def removeLayers(self, layerIds):
+    """ Layers removed from registry(window), deleted after: without disconnect in _updateLayers or close """
+    for id in layerIds:
+      layer = self.layers.pop( id, None )
+      if not layer is None:
+        layer.repaintRequested.disconnect( self.clear )
+        self.clear()
+
+  @pyqtSlot()
+  def onJobsAvailable(self):
+    self._startJobs()
+
+  def onFinishedJob(self, key):
+    value = self.jobs.pop( key, None )
+    if value is None:
+      return
+    job = value[0]
+    self.renderBudget.releaseJob( ( self, key ) )
+    if key[ : 3 ] == self._signature():
+      self._addTile( key, job.renderedImage() )
+    job.deleteLater() # Emitting finished
+    self._startJobs()
+
+
+class ProgressivePreview( QObject ):
+  """
+  While main map is in interaction(pan, zoom), the last image of canvas is shown
+  resampled to new extent(MapImageItem) and the render is hold('preview'),
+  the full render is done when main map is idle.
+  """
+  idles = ( 150, 300, 600, 1000 ) # Milliseconds
+
+  def __init__(self, parent, canvas, holdRender, stats, idle=300):
+    super( ProgressivePreview, self ).__init__( parent )
+    self.canvas, self.holdRender, self.stats = canvas, holdRender, stats
+    self.image = None # ( QImage, QgsRectangle ) of last render
+    self.item = MapImageItem( canvas )
+    self.timer = QTimer( self )
+    self.timer.setSingleShot( True )
+    self.timer.setInterval( idle )
+    self.timer.timeout.connect( self.onTimeout )
+    self.canvas.mapCanvasRefreshed.connect( self.onMapCanvasRefreshed )
+
+  def _image(self):
+    # Last rendered image, without items of canvas(marker, extent)
+    return self.canvas.map().contentImage()
+
+  def setIdle(self, idle):
+    self.timer.setInterval( idle )
+
+  def interact(self):
+    """ Need call before change the extent of canvas """
+    if not self.timer.isActive() and not self.image is None:
+      self.item.setPatches( [ self.image ] )
+      self.stats.count( 'preview' )
+    self.holdRender( 'preview' )
+    self.timer.start() # Restart while in interaction
+
+  def close(self):
+    self.timer.stop()
+    self.canvas.mapCanvasRefreshed.disconnect( self.onMapCanvasRefreshed )
+    self.item.clear()
+    self.canvas.scene().removeItem( self.item )
+    self.holdRender( 'preview', False )
+
+  @pyqtSlot()
+  def onTimeout(self):
+    self.holdRender( 'preview', False ) # Full render
+
+  @pyqtSlot()
+  def onMapCanvasRefreshed(self):
+    if self.timer.isActive():
+      return # Canceled by interaction
+    self.item.clear()
+    image = self._image()
+    if not image.isNull():
+      self.image = ( image, self.canvas.mapSettings().visibleExtent() )
+
+
+class SyncGroupFeed( QObject ):
+  """
+  Only one connection with addedChildren of each synchronized group(main map).
+  Only the added range of nodes is read, the layers are queued and applied,
+  in one batch by event loop tick, to all subscribed windows.
+  """
+  def __init__(self, parent=None):
+    super( SyncGroupFeed, self ).__init__( parent )
+    self.windows = {} # group: set of windows
+    self.pending = OrderedDict() # group: list of layers
+    self.timer = QTimer( self )
+    self.timer.setSingleShot( True )
+    self.timer.setInterval( 0 )
+    self.timer.timeout.connect( self.onTimeout )
+
+  def subscribe(self, win, group):
+    self.unsubscribe( win )
+    if not group in self.windows:
+      self.windows[ group ] = set()
+      group.addedChildren.connect( self.onAddedChildren )
+    self.windows[ group ].add( win )
+
+  def unsubscribe(self, win):
+    for group in self.windows.keys():
+      wins = self.windows[ group ]
+      if not win in wins:
+        continue
+      wins.discard( win )
+      if len( wins ) == 0:
+        group.addedChildren.disconnect( self.onAddedChildren )
+        del self.windows[ group ]
+        self.pending.pop( group, None )
+
+  @pyqtSlot('QgsLayerTreeNode', int, int)
+  def onAddedChildren(self, node, indexFrom, indexTo):
+    group = self.sender() # Node can be a subgroup of synchronized group
+    if not group in self.windows:
+      return
+    layers = self.pending.setdefault( group, [] )
+    for item in node.children()[ indexFrom : indexTo + 1 ]:
+      if isinstance( item, QgsLayerTreeGroup ):
+        layers.extend( map( lambda ltl: ltl.layer(), item.findLayers() ) )
+      elif not item.layer() is None:
+        layers.append( item.layer() )
+    if not self.timer.isActive():
+      self.timer.start()
+
+  @pyqtSlot()
+  def onTimeout(self):
+    pending, self.pending = self.pending, OrderedDict()
+    for group, layers in pending.items():
+      for win in self.windows.get( group, () ):
+        win.addedChildrenLayer( layers )
+
+
+class EditRefresh( QObject ):
+  """
+  Repaint of canvas after edit commands of vector layers.
+  Invisible layers and edits outside the extent of canvas are ignored, a burst of edits
+  is coalesced in one render(QGIS 2 clears the cache of all layers).
+  """
+  def __init__(self, parent, canvas, isVisibleLayer, interval=100):
+    super( EditRefresh, self ).__init__( parent )
+    self.canvas = canvas
+    self.isVisibleLayer = isVisibleLayer
+    self.layers = {} # id: QgsVectorLayer
+    self.dirty = {} # id: QgsRectangle(layer CRS), None is unknown region
+    self.bboxes = {} # id: { fid: QgsRectangle }, last geometry of edited features, for old region
+    self.pending = {} # id: QgsVectorLayer
+    self.timer = QTimer( self )
+    self.timer.setSingleShot( True )
+    self.timer.setInterval( interval )
+    self.timer.timeout.connect( self.onTimeout )
+
+  def _signal_slot(self, layer):
+    return (
+      { 'signal': layer.editCommandEnded, 'slot': self.onEditCommandEnded },
+      { 'signal': layer.geometryChanged, 'slot': self.onGeometryChanged },
+      { 'signal': layer.featureAdded, 'slot': self.onFeatureAdded },
+      { 'signal': layer.featureDeleted, 'slot': self.onFeatureChanged },
+      { 'signal': layer.attributeValueChanged, 'slot': self.onFeatureChanged }
+    )
+
+  def _setDirty(self, layer, rect):
+    id = layer.id()
+    if rect is None:
+      self.dirty[ id ] = None
+    elif not id in self.dirty:
+      self.dirty[ id ] = QgsRectangle( rect )
+    elif not self.dirty[ id ] is None:
+      self.dirty[ id ].combineExtentWith( rect )
+
+  def add(self, layer):
+    if not isinstance( layer, QgsVectorLayer ) or layer.id() in self.layers:
+      return
+    self.layers[ layer.id() ] = layer
+    for item in self._signal_slot( layer ):
+      item['signal'].connect( item['slot'] )
+
+  def remove(self, layer):
+    if not isinstance( layer, QgsVectorLayer ) or not layer.id() in self.layers:
+      return
+    del self.layers[ layer.id() ]
+    self.dirty.pop( layer.id(), None )
+    self.bboxes.pop( layer.id(), None )
+    self.pending.pop( layer.id(), None )
+    for item in self._signal_slot( layer ):
+      item['signal'].disconnect( item['slot'] )
+
+  def clear(self):
+    self.timer.stop()
+    for layer in self.layers.values():
+      self.remove( layer )
+
+  def _oldBBox(self, layer, fid):
+    """ Return None if the old geometry is unknown """
+    bboxes = self.bboxes.setdefault( layer.id(), {} )
+    if fid in bboxes:
+      return bboxes[ fid ]
+    if fid < 0:
+      return None # Added in this edit, not in provider
+    # Geometry not edited before, the provider has the old
+    feature = next( layer.dataProvider().getFeatures( QgsFeatureRequest( fid ) ), None )
+    if feature is None or feature.geometry() is None:
+      return None
+    return feature.geometry().boundingBox()
+
+  def onGeometryChanged(self, fid, geometry):
+    # Old and new region, feature can be moved outside of extent
+    layer = self.sender()
+    rect, oldRect = geometry.boundingBox(), self._oldBBox( layer, fid )
+    self.bboxes[ layer.id() ][ fid ] = QgsRectangle( rect )
+    self._setDirty( layer, rect )
+    self._setDirty( layer, oldRect )
+
+  def onFeatureAdded(self, fid):
+    layer = self.sender()
+    feature = next( layer.getFeatures( QgsFeatureRequest( fid ) ), None )
+    hasGeometry = not feature is None and not feature.geometry() is None
+    if hasGeometry:
+      self.bboxes.setdefault( layer.id(), {} )[ fid ] = feature.geometry().boundingBox()
+    self._setDirty( layer, feature.geometry().boundingBox() if hasGeometry else None )
+
+  def onFeatureChanged(self, fid, *args):
+    # Deleted feature or attribute (labels, symbols): the region is unknown
+    layer = self.sender()
+    if len( args ) == 0: # Deleted
+      self.bboxes.get( layer.id(), {} ).pop( fid, None )
+    self._setDirty( layer, None )
+
+  @pyqtSlot()
+  def onEditCommandEnded(self):
+    layer = self.sender()
+    id = layer.id()
+    if not id in self.dirty:
+      return
+    rect = self.dirty.pop( id )
+    if not self.isVisibleLayer( id ):
+      return
+    if not rect is None:
+      rect = self.canvas.mapSettings().layerExtentToOutputExtent( layer, rect )
+      if not rect.intersects( self.canvas.extent() ):
+        return
+    self.pending[ id ] = layer
+    if not self.timer.isActive():
+      self.timer.start()
+
+  @pyqtSlot()
+  def onTimeout(self):
+    ids, self.pending = self.pending.keys(), {}
+    if len( ids ) == 0:
+      return
+    if self.canvas.isCachingEnabled():
+      self.canvas.clearCache()
+    self.canvas.refresh()
+
+
+class RestoreStager( QObject ):
+  """
+  Release the render of windows restored from project, one by one, after the project is loaded.
+  The main map and the active window are the first, the next window is released when
+  the render of previous is finished. Hidden or minimized windows wait until shown.
+  """
+  def __init__(self, parent, qgisCanvas, timeout=3000):
+    super( RestoreStager, self ).__init__( parent )
+    self.qgisCanvas = qgisCanvas
+    self.queue = []
+    self.waiting = None # Canvas rendering
+    self.timer = QTimer( self ) # Not wait forever a render
+    self.timer.setSingleShot( True )
+    self.timer.setInterval( timeout )
+    self.timer.timeout.connect( self.onNext )
+
+  def _wait(self, canvas):
+    self.waiting = canvas
+    canvas.mapCanvasRefreshed.connect( self.onNext )
+    self.timer.start()
+
+  def _stopWait(self):
+    self.timer.stop()
+    if not self.waiting is None:
+      self.waiting.mapCanvasRefreshed.disconnect( self.onNext )
+      self.waiting = None
+
+  def start(self, windows):
+    self._stopWait()
+    self.queue = sorted( windows, key=lambda item: ( not item.isActiveRestore, item.numWin ) )
+    QTimer.singleShot( 0, self.onNext ) # After the project is loaded
+
+  def remove(self, win):
+    if win in self.queue:
+      self.queue.remove( win )
+    if self.waiting is win.canvas:
+      self._stopWait()
+      QTimer.singleShot( 0, self.onNext )
+
+  @pyqtSlot()
+  def onNext(self):
+    self._stopWait()
+    if self.qgisCanvas.isDrawing():
+      self._wait( self.qgisCanvas )
+      return
+    while len( self.queue ) > 0:
+      win = self.queue.pop( 0 )
+      if not win.isReadyRestore():
+        continue # Released by window when shown
+      win.releaseRestore()
+      if win.canvas.renderFlag():
+        self._wait( win.canvas )
+        return
+
+
+class RenderBudget( QObject ):
+  """
+  Limit of windows rendering at same time(maxJobs), the main map and the focused window have priority:
+  while main map renders, only the focused window renders.
+  The render of others is canceled and queued(hold 'budget'), released when a render ends.
+  Background jobs(prefetch) are in budget with the lowest priority: started only with free
+  budget(acquireJob) and paused(canceled) by the render of main map or windows.
+  """
+  jobsAvailable = pyqtSignal() # Free budget for background jobs
+
+  def __init__(self, parent, qgisCanvas, maxJobs=None):
+    super( RenderBudget, self ).__init__( parent )
+    if maxJobs is None:
+      maxJobs = max( 1, QThread.idealThreadCount() // 4 )
+    self.qgisCanvas, self.maxJobs = qgisCanvas, maxJobs
+    self.windows = {} # win: signal_slot
+    self.queue = [] # Windows with hold 'budget', by order of cancel
+    self.jobs = {} # Background job: function for pause(cancel)
+    self.timer = QTimer( self ) # Release after the end of signals of canvas
+    self.timer.setSingleShot( True )
+    self.timer.setInterval( 0 )
+    self.timer.timeout.connect( self.onTimeout )
+
+  def _connectQgis(self, isConnect = True):
+    signal_slot = (
+      { 'signal': self.qgisCanvas.renderStarting, 'slot': self.onRenderStartingQgis },
+      { 'signal': self.qgisCanvas.mapCanvasRefreshed, 'slot': self.onMapCanvasRefreshed }
+    )
+    if isConnect:
+      for item in signal_slot:
+        item['signal'].connect( item['slot'] )
+    else:
+      for item in signal_slot:
+        item['signal'].disconnect( item['slot'] )
+
+  def _focused(self):
+    for win in self.windows.keys():
+      if win.isActiveWindow():
+        return win
+    return None
+
+  def _totalDrawing(self, focused, exclude=None):
+    # The focused window is not in budget
+    wins = [ win for win in self.windows.keys() if not win in ( focused, exclude ) ]
+    return len( filter( lambda item: item.canvas.isDrawing(), wins ) )
+
+  def _limit(self):
+    return 0 if self.qgisCanvas.isDrawing() else self.maxJobs
+
+  def _pauseJobs(self):
+    jobs, self.jobs = self.jobs, {}
+    for job, pause in jobs.items():
+      pause( job )
+
+  def acquireJob(self, job, pause):
+    """
+    Return False without budget, try again with jobsAvailable.
+    pause: function( job ) for cancel the job, the render of main map and windows has priority
+    """
+    if self._totalDrawing( self._focused() ) + len( self.jobs ) >= self._limit():
+      return False
+    self.jobs[ job ] = pause
+    return True
+
+  def releaseJob(self, job):
+    if job in self.jobs:
+      del self.jobs[ job ]
+      self.timer.start()
+
+  def _cancel(self, win):
+    if not win in self.queue:
+      self.queue.append( win )
+    win.stats.count( 'renderBudgetQueued' )
+    win.setRenderBudget( False ) # Stop the render
+
+  def add(self, win):
+    if win in self.windows:
+      return
+    if len( self.windows ) == 0:
+      self._connectQgis()
+    signal_slot = (
+      { 'signal': win.canvas.renderStarting, 'slot': partial( self.onRenderStarting, win ) },
+      { 'signal': win.canvas.mapCanvasRefreshed, 'slot': self.onMapCanvasRefreshed }
+    )
+    for item in signal_slot:
+      item['signal'].connect( item['slot'] )
+    self.windows[ win ] = signal_slot
+
+  def remove(self, win):
+    signal_slot = self.windows.pop( win, None )
+    if signal_slot is None:
+      return
+    for item in signal_slot:
+      item['signal'].disconnect( item['slot'] )
+    if win in self.queue:
+      self.queue.remove( win )
+    if len( self.windows ) == 0:
+      self._connectQgis( False )
+      self.timer.stop()
+    else:
+      self.timer.start()
+
+  def onRenderStarting(self, win):
+    focused = self._focused()
+    if win is focused:
+      self._pauseJobs()
+      return
+    if self._totalDrawing( focused, win ) + len( self.jobs ) >= self._limit():
+      self._pauseJobs()
+    if self._totalDrawing( focused, win ) + len( self.jobs ) >= self._limit():
+      self._cancel( win )
+
+  @pyqtSlot()
+  def onRenderStartingQgis(self):
+    self._pauseJobs()
+    focused = self._focused()
+    for win in self.windows.keys():
+      if not win is focused and win.canvas.isDrawing():
+        self._cancel( win )
+
+  @pyqtSlot()
+  def onMapCanvasRefreshed(self):
+    self.timer.start()
+
+  @pyqtSlot()
+  def onTimeout(self):
+    self.queue = [ win for win in self.queue if 'budget' in win.renderHolds ] # Released by activation
+    focused = self._focused()
+    if focused in self.queue:
+      self.queue.remove( focused )
+      focused.setRenderBudget( True )
+    # Background jobs are paused by the render of released windows
+    total = self._limit() - self._totalDrawing( focused )
+    while total > 0 and len( self.queue ) > 0:
+      self.queue.pop( 0 ).setRenderBudget( True )
+      total -= 1
+    if total - len( self.jobs ) > 0:
+      self.jobsAvailable.emit()
+
+
+class TraceRecorder( QObject ):
+  """
+  Events of main map and windows, with time(milliseconds from start), in a compact file:
+  gzip, one JSON by line, the first line is the header and the others are [ time, event, args ].
+  Events: 'extent', 'xy', 'scaleFactor', 'treeAdded', 'treeRemoved', 'layersRemoved'.
+  Nodes of layer tree are the path of indexes from root, items are layer id or [ group name, layer ids ].
+  Replay: benchmark/replay_auxiliarywindow.py
+  """
+  version = 1
+
+  def __init__(self, parent, qgisCanvas):
+    super( TraceRecorder, self ).__init__( parent )
+    self.qgisCanvas = qgisCanvas
+    self.root = QgsProject.instance().layerTreeRoot()
+    self.file = self.t0 = None
+    self.windows = {} # win: slot of scale factor
+
+  @staticmethod
+  def pathNode(node):
+    path = []
+    while not node.parent() is None:
+      parent = node.parent()
+      path.insert( 0, parent.children().index( node ) )
+      node = parent
+    return path
+
+  @staticmethod
+  def nodePath(root, path):
+    node = root
+    for index in path:
+      children = node.children()
+      if index >= len( children ):
+        return None
+      node = children[ index ]
+    return node
+
+  @staticmethod
+  def itemsNode(node, indexFrom, indexTo):
+    items = []
+    for item in node.children()[ indexFrom : indexTo + 1 ]:
+      if isinstance( item, QgsLayerTreeGroup ):
+        items.append( [ item.name(), map( lambda layer: layer.layerId(), item.findLayers() ) ] )
+      else:
+        items.append( item.layerId() )
+    return items
+
+  def _connect(self, isConnect = True):
+    signal_slot = (
+      { 'signal': self.qgisCanvas.extentsChanged, 'slot': self.onExtentsChanged },
+      { 'signal': self.qgisCanvas.xyCoordinates, 'slot': self.onXYCoordinates },
+      { 'signal': self.root.addedChildren, 'slot': self.onAddedChildren },
+      { 'signal': self.root.willRemoveChildren, 'slot': self.onWillRemoveChildren },
+      { 'signal': QgsMapLayerRegistry.instance().layersWillBeRemoved, 'slot': self.onLayersWillBeRemoved }
+    )
+    if isConnect:
+      for item in signal_slot:
+        item['signal'].connect( item['slot'] )
+    else:
+      for item in signal_slot:
+        item['signal'].disconnect( item['slot'] )
+
+  def _write(self, event, args):
+    t = round( ( time.time() - self.t0 ) * 1000.0, 1 )
+    self.file.write( json.dumps( [ t, event, args ], separators=( ',', ':' ) ) + '\n' )
+
+  def isRecording(self):
+    return not self.file is None
+
+  def start(self, filename, windows):
+    if self.isRecording():
+      self.stop()
+    r, size = self.qgisCanvas.extent(), self.qgisCanvas.size()
+    header = {
+      'version': self.version,
+      'project': QgsProject.instance().fileName(),
+      'crs': self.qgisCanvas.mapSettings().destinationCrs().authid(),
+      'size': [ size.width(), size.height() ],
+      'extent': [ r.xMinimum(), r.yMinimum(), r.xMaximum(), r.yMaximum() ],
+      'windows': map( lambda item: { 'numWin': item.numWin, 'layers': item.layerNodes.keys() }, windows )
+    }
+    self.file = gzip.open( filename, 'wb' )
+    self.file.write( json.dumps( header, separators=( ',', ':' ) ) + '\n' )
+    self.t0 = time.time()
+    self._connect()
+    for win in windows:
+      self.add( win )
+
+  def stop(self):
+    if not self.isRecording():
+      return
+    self._connect( False )
+    for win in self.windows.keys():
+      self.remove( win )
+    self.file.close()
+    self.file = None
+
+  def add(self, win):
+    if not self.isRecording() or win in self.windows:
+      return
+    slot = partial( self.onValueChangedScale, win.numWin )
+    win.widgets['scaleFactorSpin'].valueChanged.connect( slot )
+    self.windows[ win ] = slot
+
+  def remove(self, win):
+    slot = self.windows.pop( win, None )
+    if not slot is None:
+      win.widgets['scaleFactorSpin'].valueChanged.disconnect( slot )
+
+  def onValueChangedScale(self, numWin, scaleFactor):
+    self._write( 'scaleFactor', [ numWin, scaleFactor ] )
+
+  @pyqtSlot()
+  def onExtentsChanged(self):
+    r = self.qgisCanvas.extent()
+    self._write( 'extent', [ r.xMinimum(), r.yMinimum(), r.xMaximum(), r.yMaximum() ] )
+
+  @pyqtSlot( 'QgsPoint' )
+  def onXYCoordinates(self, point):
+    self._write( 'xy', [ point.x(), point.y() ] )
+
+  @pyqtSlot('QgsLayerTreeNode', int, int)
+  def onAddedChildren(self, node, indexFrom, indexTo):
+    self._write( 'treeAdded', [ self.pathNode( node ), indexFrom, self.itemsNode( node, indexFrom, indexTo ) ] )
+
+  @pyqtSlot('QgsLayerTreeNode', int, int)
+  def onWillRemoveChildren(self, node, indexFrom, indexTo):
+    self._write( 'treeRemoved', [ self.pathNode( node ), indexFrom, self.itemsNode( node, indexFrom, indexTo ) ] )
+
+  @pyqtSlot( list )
+  def onLayersWillBeRemoved(self, theLayerIds):
+    self._write( 'layersRemoved', theLayerIds )
+
+
+class BatchExport( QObject ):
+  """
+  Images of windows(layers, extent and size of canvas) rendered in parallel, in background,
+  with at most maxJobs renders at same time. The size is scaled for dpi.
+  With the Extent checked, the extent of main map is drawn in image.
+  The jobs are not in render budget of windows(RenderBudget, one job by core is too slow for export),
+  the jobs are started only when main map is not rendering and are not paused.
+  """
+  finished = pyqtSignal( list, float ) # Files, seconds
+
+  def __init__(self, parent, qgisCanvas, maxJobs=None):
+    super( BatchExport, self ).__init__( parent )
+    if maxJobs is None:
+      maxJobs = max( 2, QThread.idealThreadCount() // 2 )
+    self.qgisCanvas, self.maxJobs = qgisCanvas, maxJobs
+    self.queue = [] # ( filename, QgsMapSettings, QgsRectangle or None )
+    self.jobs = {} # filename: ( job, QgsRectangle or None )
+    self.files, self.t0 = [], None
+
+  def _startJobs(self):
+    if self.qgisCanvas.isDrawing():
+      return # Restart when main map is refreshed
+    while len( self.jobs ) < self.maxJobs and len( self.queue ) > 0:
+      filename, settings, extent = self.queue.pop( 0 )
+      job = QgsMapRendererParallelJob( settings )
+      job.setParent( self ) # Deleted by deleteLater, not by Python in finished
+      job.finished.connect( partial( self.onFinishedJob, filename ) )
+      self.jobs[ filename ] = ( job, extent )
+      job.start()
+
+  def _drawExtent(self, image, settings, extent):
+    m2p = settings.mapToPixel()
+    p1 = m2p.transform( QgsPoint( extent.xMinimum(), extent.yMaximum() ) )
+    p2 = m2p.transform( QgsPoint( extent.xMaximum(), extent.yMinimum() ) )
+    painter = QPainter( image )
+    painter.setRenderHint( QPainter.Antialiasing )
+    painter.setPen( QPen( QColor( 255, 0, 0 ), 2 * settings.outputDpi() / 96.0 ) )
+    painter.drawRect( QRectF( p1.x(), p1.y(), p2.x() - p1.x(), p2.y() - p1.y() ) )
+    painter.end()
+
+  def isRunning(self):
+    return len( self.jobs ) > 0 or len( self.queue ) > 0
+
+  def start(self, windows, directory, dpi=300):
+    """ Return False if running """
+    if self.isRunning():
+      return False
+    self.files, self.t0 = [], time.time()
+    self.qgisCanvas.mapCanvasRefreshed.connect( self.onMapCanvasRefreshedQgis )
+    for win in windows:
+      settings = QgsMapSettings( win.canvas.mapSettings() )
+      factor = float( dpi ) / settings.outputDpi()
+      size = settings.outputSize()
+      settings.setOutputSize( QSize( int( size.width() * factor ), int( size.height() * factor ) ) )
+      settings.setOutputDpi( dpi )
+      settings.setFlag( QgsMapSettings.Antialiasing, True )
+      extent = win.qgisExtent() if win.widgets['extentCheck'].isChecked() else None
+      filename = os.path.join( directory, "auxiliary_window_%d.png" % win.numWin )
+      self.queue.append( ( filename, settings, extent ) )
+    self._startJobs()
+    return True
+
+  def _end(self):
+    self.qgisCanvas.mapCanvasRefreshed.disconnect( self.onMapCanvasRefreshedQgis )
+
+  def cancel(self):
+    if not self.isRunning():
+      return
+    self.queue = []
+    jobs, self.jobs = self.jobs, {}
+    for job, extent in jobs.values():
+      job.cancel()
+      job.deleteLater()
+    self._end()
+
+  @pyqtSlot()
+  def onMapCanvasRefreshedQgis(self):
+    self._startJobs()
+
+  def onFinishedJob(self, filename):
+    value = self.jobs.pop( filename, None )
+    if value is None:
+      return # Canceled
+    job, extent = value
+    image = job.renderedImage()
+    job.deleteLater() # Emitting finished
+    if not extent is None:
+      self._drawExtent( image, job.mapSettings(), extent )
+    if image.save( filename, 'PNG' ):
+      self.files.append( filename )
+    self._startJobs()
+    if not self.isRunning():
+      self._end()
+      self.finished.emit( self.files, time.time() - self.t0 )
 
 
 class AuxiliaryWindow(QMainWindow):
   
   closed = pyqtSignal( int )
+  syncGroupChanged = pyqtSignal( int )
+  linkChanged = pyqtSignal( int, int ) # numWin, numWin of followed window(0 is main map)
+  layerIdsChanged = pyqtSignal( int, list, list ) # numWin, added and removed ids
+
+  # ( name, setting of canvas )
+  # Only settings of canvas in QGIS 2, labels and simplification are of main map(flags of map settings)
+  renderProfiles = (
+    ( 'Quality', { 'parallel': True, 'cache': True, 'antialiasing': True } ),
+    ( 'Fast', { 'parallel': True, 'cache': True, 'antialiasing': False } ),
+    ( 'Single thread', { 'parallel': False, 'cache': False, 'antialiasing': False } )
+  )
+  renderProfileDefault = 'Fast' # Old setting 'Balanced' is the same
+  settingVersion = 2 # 1: 'layerIds' and 'visibles' are space-joined strings
   
-  def __init__(self, parent, geometryWin, numWin):
+  def __init__(self, parent, geometryWin, numWin, syncGraph, renderBudget):
     
     def populateStatusBar():
       statusBar = self.statusBar()
@@ -234,6 +1560,53 @@ class AuxiliaryWindow(QMainWindow):
       w.setObjectName( 'markerCheck')
       w.setToolTip( "Toggle marker with cursor position from main map" )
       w.setChecked( False )
+      statusBar.addPermanentWidget( w )
+
+      w = QComboBox( self )
+      w.setObjectName( 'markerRateCombo')
+      w.setToolTip( "Rate of update marker with cursor position from main map" )
+      for rate in MarkerWindow.rates:
+        w.addItem( "%d Hz" % rate, rate )
+      w.setCurrentIndex( MarkerWindow.rates.index( self.marker.rate ) )
+      statusBar.addPermanentWidget( w, 1 )
+
+      w = QComboBox( self )
+      w.setObjectName( 'renderProfileCombo')
+      w.setToolTip( "Rendering profile: threads, cache and antialiasing" )
+      for name, profile in self.renderProfiles:
+        w.addItem( name )
+      w.setCurrentIndex( w.findText( self.renderProfileDefault ) )
+      statusBar.addPermanentWidget( w, 1 )
+
+      w = QToolButton( self )
+      w.setObjectName( 'crsBtn')
+      w.setToolTip( "CRS of window, the extent and the cursor of main map are transformed" )
+      w.setPopupMode( QToolButton.InstantPopup )
+      menu = QMenu( w )
+      menu.addAction( "Main map" ).setObjectName( 'crsQgis' )
+      menu.addAction( "Select CRS..." ).setObjectName( 'crsSelect' )
+      w.setMenu( menu )
+      w.setText( "CRS: Main map" )
+      statusBar.addPermanentWidget( w, 1 )
+
+      w = QCheckBox( "Prefetch", self )
+      w.setObjectName( 'prefetchCheck')
+      w.setToolTip( "Render in background the tiles around the map, for pans" )
+      w.setChecked( False )
+      statusBar.addPermanentWidget( w, 1 )
+
+      w = QCheckBox( "Preview", self )
+      w.setObjectName( 'previewCheck')
+      w.setToolTip( "Show the last map while main map is in pan or zoom, render when main map is idle" )
+      w.setChecked( False )
+      statusBar.addPermanentWidget( w, 1 )
+
+      w = QComboBox( self )
+      w.setObjectName( 'previewIdleCombo')
+      w.setToolTip( "Time of main map without pan or zoom for render" )
+      for idle in ProgressivePreview.idles:
+        w.addItem( "%d ms" % idle, idle )
+      w.setCurrentIndex( ProgressivePreview.idles.index( self.previewIdle ) )
       statusBar.addPermanentWidget( w, 1 )
 
       w = QCheckBox( "Extent", self )
@@ -248,6 +1621,12 @@ class AuxiliaryWindow(QMainWindow):
       w.setText("Highlight")
       statusBar.addPermanentWidget( w, 1 )
 
+      w = QComboBox( self )
+      w.setObjectName( 'linkCombo')
+      w.setToolTip( "Map followed by this window (center, and scale by scale factor)" )
+      w.addItem( "Main map", 0 )
+      statusBar.addPermanentWidget( w, 1 )
+
       w = QLabel( "Scale factor:", self )
       w.setObjectName( 'scaleFactorLabel')
       w.setAlignment(Qt.AlignRight | Qt.AlignVCenter)
@@ -255,8 +1634,8 @@ class AuxiliaryWindow(QMainWindow):
 
       w = QDoubleSpinBox(self)
       w.setObjectName( 'scaleFactorSpin')
-      w.setToolTip( "Current scale factor of main map" )
-      w.setMinimum(0.0)
+      w.setToolTip( "Scale factor of followed map" )
+      w.setMinimum(0.001) # Not zero, factor of scale is divisor (mirror)
       w.setMaximum(1000.0)
       w.setDecimals(3)
       w.setValue(1)
@@ -275,24 +1654,23 @@ class AuxiliaryWindow(QMainWindow):
       self.addDockWidget ( Qt.LeftDockWidgetArea, self.dockLegend )
       self.actLegend = self.menuBar().addAction("")
       self.actLegend.triggered.connect( self.onActionLegend )
+      self.actDiagnostics = self.menuBar().addAction( "Diagnostics" )
+      self.actDiagnostics.setCheckable( True )
+      self.actDiagnostics.toggled.connect( self.onToggledDiagnostics )
       self.canvas.setMapTool( self.toolPan )
       self.canvas.setCanvasColor( QColor(255,255,255) )
-      self.canvas.enableAntiAliasing( False )
-      self.canvas.useImageToRender( False )
       self.canvas.setWheelAction( QgsMapCanvas.WheelZoom )
       self.setCentralWidget( centralWidget )
-      self.messageBar.setSizePolicy( QSizePolicy.Minimum, QSizePolicy.Fixed )
       layout = QGridLayout()
       layout.setContentsMargins( 0, 0, 0, 0 )
       layout.addWidget( self.canvas, 0, 0, 2, 1 )
-      layout.addWidget( self.messageBar, 0, 0, 1, 1 )
       centralWidget.setLayout( layout )
 
     super( AuxiliaryWindow, self ).__init__( parent )
 
     centralWidget = QWidget( self )
     self.canvas = QgsMapCanvas( centralWidget )
-    self.messageBar = QgsMessageBar( centralWidget )
+    self.messageBar = None # Created by first message
     self.toolPan = QgsMapToolPan( self.canvas )
     self.qgisCanvas = qgis.utils.iface.mapCanvas()
     self.qgisTView = qgis.utils.iface.layerTreeView()
@@ -300,36 +1678,73 @@ class AuxiliaryWindow(QMainWindow):
     self.numWin = numWin
 
     self.ltg = QgsLayerTreeGroup('', Qt.Unchecked)
+    self.layerNodes = {} # Index of layers in self.ltg, id: QgsLayerTreeLayer
+    self.ltg.addedChildren.connect( self.onAddedChildrenLtg )
+    self.ltg.willRemoveChildren.connect( self.onWillRemoveChildrenLtg )
     self.dockLegend = AuxiliaryLegend( self, numWin )
     self.root = QgsProject.instance().layerTreeRoot()
     
 
-    self.extent = self.actLegend = None
-    self.marker = MarkerWindow( self.canvas )
+    self.extent = self.actLegend = self.actDiagnostics = None
+    self.stats = HotPathStats()
+    self.renderTime = None # Start of render
+    self.dockDiagnostics = None # Created when first shown
+    self.syncGraph = syncGraph
+    self.renderBudget = renderBudget # Container, for background jobs(prefetch)
+    self.marker = MarkerWindow( self.canvas, self.stats, self.syncGraph.transforms )
+    self.scheduler = SyncScheduler( self, self.canvas )
+    self.prefetch = None
+    self.preview, self.previewIdle = None, 300
+    self.editRefresh = EditRefresh( self, self.canvas, self._isVisibleLayer )
+    self.transactionDepth = 0
+    self.renderHolds = set() # Reasons for suspend the render of canvas
+    self.isActiveRestore = False
+    self.timeActivated = 0.0
+    self.isDirty = False # Main map changed while window not shown
+    self.syncGeneration = 0 # Last change of graph applied
+    self.crs = None # Own CRS, None is the CRS of main map
+    self.totalConnections = 0 # Signals connected by _connect
+    self.setAttribute( Qt.WA_DeleteOnClose )
 
     setupUi()
     populateStatusBar()
-
-    self.onCurrentLayerChanged( None )
-    self.onDestinationCrsChanged_MapUnitsChanged()
-    self.onHasCrsTransformEnabledChanged( self.qgisCanvas.hasCrsTransformEnabled() )
-    
-  def _connect(self, isConnect = True):
-    widgets = {
+    self.widgets = {
      'scaleBtn': self.findChild( QToolButton, 'scaleBtn'),
+     'linkCombo': self.findChild( QComboBox, 'linkCombo'),
      'renderCheck': self.findChild( QCheckBox, 'renderCheck'),
      'markerCheck': self.findChild( QCheckBox, 'markerCheck'),
+     'markerRateCombo': self.findChild( QComboBox, 'markerRateCombo'),
      'extentCheck': self.findChild( QCheckBox, 'extentCheck'),
+     'prefetchCheck': self.findChild( QCheckBox, 'prefetchCheck'),
+     'previewCheck': self.findChild( QCheckBox, 'previewCheck'),
+     'previewIdleCombo': self.findChild( QComboBox, 'previewIdleCombo'),
      'highlightBtn': self.findChild( QToolButton, 'highlightBtn'),
-     'scaleFactorSpin': self.findChild( QDoubleSpinBox, 'scaleFactorSpin')
+     'scaleFactorSpin': self.findChild( QDoubleSpinBox, 'scaleFactorSpin'),
+     'renderProfileCombo': self.findChild( QComboBox, 'renderProfileCombo'),
+     'crsBtn': self.findChild( QToolButton, 'crsBtn')
     }
+
+    self._setRenderProfile( self.renderProfileDefault )
+    self.onCurrentLayerChanged( None )
+    self.onDestinationCrsChanged_MapUnitsChanged()
+    self.onHasCrsTransformEnabledChanged( self.qgisCanvas.hasCrsTransformEnabled() )
+    
+  def _connect(self, isConnect = True):
+    widgets = self.widgets
     signal_slot = (
       { 'signal': widgets['scaleBtn'].clicked, 'slot': self.onClickedScale },
       { 'signal': widgets['renderCheck'].toggled, 'slot': self.onToggledRender },
       { 'signal': widgets['markerCheck'].toggled, 'slot': self.onToggledMarker },
+      { 'signal': widgets['markerRateCombo'].currentIndexChanged[int], 'slot': self.onCurrentIndexChangedMarkerRate },
       { 'signal': widgets['extentCheck'].toggled, 'slot': self.onToggledExtent },
+      { 'signal': widgets['prefetchCheck'].toggled, 'slot': self.onToggledPrefetch },
+      { 'signal': widgets['previewCheck'].toggled, 'slot': self.onToggledPreview },
+      { 'signal': widgets['previewIdleCombo'].currentIndexChanged[int], 'slot': self.onCurrentIndexChangedPreviewIdle },
       { 'signal': widgets['highlightBtn'].clicked, 'slot': self.onClickedHighlight },
       { 'signal': widgets['scaleFactorSpin'].valueChanged, 'slot': self.onValueChangedScale },
+      { 'signal': widgets['linkCombo'].activated[int], 'slot': self.onActivatedLink },
+      { 'signal': widgets['crsBtn'].menu().triggered, 'slot': self.onTriggeredCrs },
+      { 'signal': widgets['renderProfileCombo'].activated[str], 'slot': self._setRenderProfile },
       { 'signal': self.dockLegend.currentLayerChanged, 'slot': self.onCurrentLayerChanged },
       { 'signal': self.dockLegend.currentLayerQgis, 'slot': self.onCurrentLayerQgis },
       { 'signal': self.dockLegend.syncGroupLayer, 'slot': self.onSyncGroupAddLayersQgis },
@@ -338,13 +1753,8 @@ class AuxiliaryWindow(QMainWindow):
       { 'signal': self.dockLegend.needSelectLayer, 'slot': self.onNeedSelectLayer },
       { 'signal': self.dockLegend.closed, 'slot': self.onClosedLegend },
       { 'signal': self.canvas.extentsChanged, 'slot': self.onExtentsChangedMirror },
-      { 'signal': self.qgisCanvas.extentsChanged, 'slot': self.onExtentsChangedQgisCanvas },
-      { 'signal': self.qgisCanvas.xyCoordinates, 'slot': self.marker.onXYCoordinates },
-      { 'signal': self.qgisCanvas.destinationCrsChanged, 'slot': self.onDestinationCrsChanged_MapUnitsChanged },
-      { 'signal': self.qgisCanvas.mapUnitsChanged, 'slot': self.onDestinationCrsChanged_MapUnitsChanged },
-      { 'signal': self.qgisCanvas.hasCrsTransformEnabledChanged, 'slot': self.onHasCrsTransformEnabledChanged },
-      { 'signal': self.root.removedChildren, 'slot': self.onRemovedChildrenQgisRoot },
-      { 'signal': QgsMapLayerRegistry.instance().layersWillBeRemoved, 'slot': self.onLayersWillBeRemoved }
+      { 'signal': self.canvas.renderStarting, 'slot': self.onRenderStarting },
+      { 'signal': self.canvas.mapCanvasRefreshed, 'slot': self.onMapCanvasRefreshed }
     )
     if isConnect:
       for item in signal_slot:
@@ -352,64 +1762,239 @@ class AuxiliaryWindow(QMainWindow):
     else:
       for item in signal_slot:
         item['signal'].disconnect( item['slot'] )
+    self.totalConnections = len( signal_slot ) if isConnect else 0
 
-  def _extentsChanged(self, canvasOrigin, originSlot, canvasDest, scaleFactor=None):
-    canvasOrigin.extentsChanged.disconnect( originSlot )
-
-    if scaleFactor is None:
+  def _extentsChanged(self, canvasOrigin, extent, scale=None):
+    if scale is None:
       scale = canvasOrigin.scale()
-      canvasOrigin.setExtent( canvasDest.extent() )
+    # Same center and scale, without render
+    if canvasOrigin.extent().center() == extent.center() and abs( canvasOrigin.scale() - scale ) <= 1e-9 * scale:
+      return
+    with self.syncGraph.apply( canvasOrigin ):
+      prevFlag = canvasOrigin.renderFlag()
+      canvasOrigin.setRenderFlag( False ) # setExtent and zoomScale with only one render
+      canvasOrigin.setExtent( extent )
       canvasOrigin.zoomScale( scale )
+      canvasOrigin.setRenderFlag( prevFlag )
+
+  def _textScaleBtnChanched(self, text=None):
+    if text is None:
+      scale = locale.format( "%.0f", self.canvas.scale(), True ) 
+      text = "Scale 1:%s" % scale
+    self.widgets['scaleBtn'].setText( text )
+
+  def _extent(self, rect=None):
+    if self.extent is None or not self.extent.isVisible():
+      return
+    if rect is None:
+      rect = self.qgisExtent()
+      if rect is None:
+        return # Not transformed
+    self.extent.setExtent( rect )
+
+  def _transformToQgis(self, rect):
+    # Return None if can not be transformed
+    if self.crs is None:
+      return rect
+    crsQgis = self.qgisCanvas.mapSettings().destinationCrs()
+    return self.syncGraph.transforms.rect( rect, self.crs, crsQgis )
+
+  def qgisExtent(self):
+    """ Extent of main map in CRS of window, None if can not be transformed """
+    if self.crs is None:
+      return self.qgisCanvas.extent()
+    crsQgis = self.qgisCanvas.mapSettings().destinationCrs()
+    return self.syncGraph.transforms.rect( self.qgisCanvas.extent(), crsQgis, self.crs )
+
+  def setCrs(self, crs=None):
+    """ crs: None is the CRS of main map """
+    self.crs = crs
+    if crs is None:
+      self.onDestinationCrsChanged_MapUnitsChanged()
+      self.onHasCrsTransformEnabledChanged( self.qgisCanvas.hasCrsTransformEnabled() )
+      self.widgets['crsBtn'].setText( "CRS: Main map" )
     else:
-      canvasOrigin.setExtent( canvasDest.extent() )
-      canvasOrigin.zoomScale( scaleFactor * canvasDest.scale() )
-
-    canvasOrigin.extentsChanged.connect( originSlot )
-
-  def _textScaleBtnChanched(self):
-    scale = locale.format( "%.0f", self.canvas.scale(), True ) 
-    w = self.findChild( QToolButton, 'scaleBtn' )
-    w.setText("Scale 1:%s" % scale )
-
-  def _extent(self):
-   rect = self.qgisCanvas.extent()
-   p1 = QgsPoint( rect.xMinimum() , rect.yMinimum() )
-   p2 = QgsPoint( rect.xMinimum() , rect.yMaximum() )
-   p3 = QgsPoint( rect.xMaximum() , rect.yMaximum() )
-   p4 = QgsPoint( rect.xMaximum() , rect.yMinimum() )
-   p5 = QgsPoint( rect.xMinimum() , rect.yMinimum() )
-   points = [ p1, p2, p3, p4, p5 ]
-   self.extent.setToGeometry(QgsGeometry.fromPolyline (points), None)
-
-  def _execFunction( self, func, arg, signal, slot):
-   signal.disconnect( slot )
-   func( arg )
-   signal.connect( slot )
+      prevFlag = self.canvas.renderFlag()
+      self.canvas.setRenderFlag( False )
+      self.canvas.mapRenderer().setProjectionsEnabled( True )
+      self.canvas.setDestinationCrs( crs )
+      self.canvas.setMapUnits( crs.mapUnits() )
+      self.canvas.setRenderFlag( prevFlag )
+      self.widgets['crsBtn'].setText( "CRS: %s" % ( crs.authid() or crs.description() ) )
+    if self.widgets['renderCheck'].isChecked():
+      self._syncQgisCanvas( QgisCanvasState( self.qgisCanvas, self.syncGraph.transforms ) )
+
+  @pyqtSlot(str)
+  def _setRenderProfile(self, name):
+    profile = dict( self.renderProfiles ).get( name )
+    if profile is None:
+      return
+    self.renderProfile = name
+
+    prevFlag = self.canvas.renderFlag()
+    self.canvas.setRenderFlag( False )
+
+    self.canvas.setParallelRenderingEnabled( profile['parallel'] )
+    self.canvas.setCachingEnabled( profile['cache'] )
+    self.canvas.enableAntiAliasing( profile['antialiasing'] )
+
+    self.canvas.setRenderFlag( prevFlag )
 
   def _connectVectorRefresh(self, layer, isConnect=True):
-    if isinstance( layer, QgsVectorLayer ):
-      f = layer.editCommandEnded.connect if isConnect else layer.editCommandEnded.disconnect
-      f( self.canvas.refresh )
+    self.editRefresh.add( layer ) if isConnect else self.editRefresh.remove( layer )
 
-  def _addLayersQgis( self, layersQgis, needMsg=True ):
-    
-    self.dockLegend.clearBridge()
+  def _isVisibleLayer(self, layerId):
+    node = self.layerNodes.get( layerId )
+    if node is None or node.isVisible() == Qt.Unchecked:
+      return False
+    layer = node.layer()
+    return not layer.hasScaleBasedVisibility() or layer.isInScaleRange( self.canvas.scale() )
+
+  def _holdRender(self, reason, hold=True):
+    """
+    The canvas renders only without holds.
+    Reasons: 'user'(Render check), 'transaction', 'restore'(project), 'hidden', 'preview', 'budget'
+    """
+    if hold:
+      self.renderHolds.add( reason )
+    else:
+      self.renderHolds.discard( reason )
+    isRender = len( self.renderHolds ) == 0
+    if self.canvas.renderFlag() != isRender:
+      self.canvas.setRenderFlag( isRender )
+
+  def _isOnScreen(self):
+    desktop = QApplication.desktop()
+    rect = self.frameGeometry()
+    for id in range( desktop.screenCount() ):
+      if desktop.availableGeometry( id ).intersects( rect ):
+        return True
+    return False
+
+  def isShown(self):
+    """
+    Visible, not minimized and canvas not clipped(empty visible region).
+    Qt4 not known the occlusion by others top-level windows, a window covered is shown.
+    """
+    if not self.isVisible() or self.isMinimized():
+      return False
+    return not self.canvas.visibleRegion().isEmpty()
+
+  def _hideSync(self):
+    if not 'hidden' in self.renderHolds:
+      self._holdRender( 'hidden' )
+      self.canvas.viewport().installEventFilter( self ) # Paint when uncovered
+
+  def _catchUpSync(self):
+    """ Only one sync and render with the current extent of main map """
+    if not 'hidden' in self.renderHolds or not self.isShown():
+      return
+    self.canvas.viewport().removeEventFilter( self )
+    if self.isDirty and self.widgets['renderCheck'].isChecked():
+      self._syncQgisCanvas( QgisCanvasState( self.qgisCanvas, self.syncGraph.transforms ) )
+    self.isDirty = False
+    self._holdRender( 'hidden', False )
+
+  def eventFilter(self, obj, event):
+    if event.type() == QEvent.Paint and 'hidden' in self.renderHolds:
+      QTimer.singleShot( 0, self._catchUpSync )
+    return super( AuxiliaryWindow, self ).eventFilter( obj, event )
+
+  def isReadyRestore(self):
+    return self.isVisible() and not self.isMinimized() and self._isOnScreen()
+
+  def releaseRestore(self):
+    if 'restore' in self.renderHolds:
+      self._holdRender( 'restore', False )
+
+  def _pushMessage(self, msg, level, duration):
+    if self.messageBar is None:
+      self.messageBar = QgsMessageBar( self.centralWidget() )
+      self.messageBar.setSizePolicy( QSizePolicy.Minimum, QSizePolicy.Fixed )
+      self.centralWidget().layout().addWidget( self.messageBar, 0, 0, 1, 1 )
+    self.messageBar.pushMessage( msg, level, duration )
+
+  def setScaleFactor(self, scaleFactor):
+    # Without onValueChangedScale
+    w = self.widgets['scaleFactorSpin']
+    w.blockSignals( True )
+    w.setValue( scaleFactor )
+    w.blockSignals( False )
+
+  def setLinkChoices(self, numWins, current):
+    # Container(SyncGraph), only windows that can be followed
+    w = self.widgets['linkCombo']
+    w.clear()
+    w.addItem( "Main map", 0 )
+    for numWin in numWins:
+      w.addItem( "#%d" % numWin, numWin )
+    w.setCurrentIndex( max( 0, w.findData( current ) ) )
+
+  def setRenderBudget(self, enabled):
+    # RenderBudget(container)
+    self._holdRender( 'budget', not enabled )
+
+  def beginLayerTransaction(self):
+    """
+    Suspend the updates of canvas and legend until commitLayerTransaction.
+    Transactions can be nested, only the outer commit updates the canvas.
+    """
+    self.transactionDepth += 1
+    if self.transactionDepth > 1:
+      return
+    self._holdRender( 'transaction' )
+    self.dockLegend.tview.setUpdatesEnabled( False )
+
+  def commitLayerTransaction(self):
+    self.transactionDepth -= 1
+    if self.transactionDepth > 0:
+      return
+    # Only one update of layer set(bridge) and one render(render flag)
+    if not self.dockLegend.bridge is None:
+      self.dockLegend.bridge.setCanvasLayers()
+    self.dockLegend.tview.setUpdatesEnabled( True )
+    self._holdRender( 'transaction', False )
+
+  @contextmanager
+  def layerTransaction(self):
+    """
+    Usage:
+      with self.layerTransaction() as ltg:
+        ltg.addLayer( layer )
+    """
+    self.beginLayerTransaction()
+    try:
+      yield self.ltg
+    finally:
+      self.commitLayerTransaction()
+
+  def _nodesLayer(self, node, indexFrom, indexTo):
+    nodes = []
+    for item in node.children()[ indexFrom : indexTo + 1 ]:
+      if isinstance( item, QgsLayerTreeGroup ):
+        nodes.extend( item.findLayers() )
+      else:
+        nodes.append( item )
+    return nodes
 
-    l1 = set( layersQgis )
-    l2 = set( map( lambda item: item.layer(), self.ltg.findLayers() ) )
-    layers = list( l1 - l2 )
+  @hotPath('_addLayersQgis')
+  def _addLayersQgis( self, layersQgis, needMsg=True ):
+    # New layers, by order of layersQgis
+    layers, ids = [], set()
+    for item in layersQgis:
+      id = item.id()
+      if not id in self.layerNodes and not id in ids:
+        ids.add( id )
+        layers.append( item )
     if len( layers ) == 0:
       if needMsg:
-        self.messageBar.pushMessage("Need select new layer(s) in main map", QgsMessageBar.WARNING, 2 )
+        self._pushMessage("Need select new layer(s) in main map", QgsMessageBar.WARNING, 2 )
     else:
-      # Get order by layersQgis
-      for item in layersQgis:
-        if item in layers:
-          self.ltg.addLayer( item )
+      with self.layerTransaction() as ltg:
+        for item in layers:
+          ltg.addLayer( item )
           self._connectVectorRefresh( item )
 
-    self.dockLegend.setBridge( self.canvas )
-
   def _syncGroupAddLayersQgis( self, ltg ):
     layersQgis = map( lambda item: item.layer(), ltg.findLayers() )
     if len( layersQgis ) == 0:
@@ -418,18 +2003,15 @@ class AuxiliaryWindow(QMainWindow):
     name = ltg.name()
     if self.qgisSyncGroup == ltg:
       msg = "Already synchronized group (main map) -> '%s'" % name
-      self.messageBar.pushMessage( msg, QgsMessageBar.INFO, 4 )
+      self._pushMessage( msg, QgsMessageBar.INFO, 4 )
       return True
     
-    if not self.qgisSyncGroup is None:
-      self.qgisSyncGroup.addedChildren.disconnect( self.addedChildrenLayer )
-      
     self.qgisSyncGroup = ltg
-    self.qgisSyncGroup.addedChildren.connect( self.addedChildrenLayer )
+    self.syncGroupChanged.emit( self.numWin ) # Container(SyncGroupFeed) add the new layers
     
     self.dockLegend.addNameSyncGroup( name )
     msg = "Changed synchronized group (main map) -> '%s'" % name
-    self.messageBar.pushMessage( msg, QgsMessageBar.INFO, 4 )
+    self._pushMessage( msg, QgsMessageBar.INFO, 4 )
     
     self._addLayersQgis( layersQgis )
     return True
@@ -468,71 +2050,229 @@ class AuxiliaryWindow(QMainWindow):
     return ( layerIds, layerChecks )
 
   def setLayersCanvas(self, layerIds, layerChecks ):
-    prevFlag = self.canvas.renderFlag()
-    self.canvas.setRenderFlag( False )
-
     lyrRegs = QgsMapLayerRegistry.instance()
-    for id in range( len( layerIds ) ):
-      layer = lyrRegs.mapLayer(  layerIds[id] )
-      isVisible = int( layerChecks[id] )
-      if not layer is None:
-        self.ltg.addLayer( layer ).setVisible( isVisible )
-
-    self.canvas.setRenderFlag( prevFlag )
+    with self.layerTransaction() as ltg:
+      for id in range( len( layerIds ) ):
+        layer = lyrRegs.mapLayer(  layerIds[id] )
+        isVisible = int( layerChecks[id] )
+        if not layer is None:
+          ltg.addLayer( layer ).setVisible( isVisible )
+
+  @staticmethod
+  def _layersSetting(windowSetting):
+    """ Return [ ( layerId, visible ) ] of any version of setting """
+    if windowSetting.get( 'version', 1 ) == 1:
+      # Space-joined strings
+      layerIds = windowSetting['layerIds'].split(' ')
+      visibles = map( lambda item: bool( int( item ) ), windowSetting['visibles'].split(' ') )
+      return zip( layerIds, visibles )
+    return map( lambda item: ( item['id'], bool( item['visible'] ) ), windowSetting['layers'] )
+
+  @staticmethod
+  def nodesLayerQgis():
+    """ Index of layers in main map, { layerId: QgsLayerTreeLayer } """
+    root = QgsProject.instance().layerTreeRoot()
+    return dict( map( lambda item: ( item.layerId(), item ), root.findLayers() ) )
 
   def getWindowSetting(self):
     g = self.geometry()
     r = self.canvas.extent()
     nodes = self.ltg.findLayers()
     currentLayer = self.dockLegend.tview.currentLayer()
-    currentLayerId = currentLayer.id() if not currentLayer is None else "None"
+    currentLayerId = currentLayer.id() if not currentLayer is None else None
     
     windowSetting =  {
+      'version': self.settingVersion,
       'numWin': self.numWin,
       'geometryWin': { 'x': g.x(), 'y': g.y(), 'width': g.width(), 'height': g.height() },
       'extentCanvas': { 'xmin': r.xMinimum(), 'ymin': r.yMinimum(), 'xmax': r.xMaximum(), 'ymax': r.yMaximum() },
       'currentLayerId': currentLayerId,
-      'layerIds' : ' '.join( map(lambda item: item.layerId(), nodes ) ),
-      'visibles': ' '.join( map(lambda item: str( int( item.isVisible() ) ), nodes ) )
+      'layers': map( lambda item: { 'id': item.layerId(), 'visible': int( item.isVisible() != Qt.Unchecked ) }, nodes )
     }
-    for item in ( 'render', 'marker', 'extent' ):
+    for item in ( 'render', 'marker', 'extent', 'prefetch', 'preview' ):
       nameGui = "%sCheck" % item
       windowSetting[ item ] = int( self.findChild( QCheckBox, nameGui).isChecked() )
+    windowSetting['markerRate'] = self.marker.rate
+    windowSetting['previewIdle'] = self.previewIdle
+    windowSetting['renderProfile'] = self.renderProfile
+    windowSetting['scaleFactor'] = self.widgets['scaleFactorSpin'].value()
+    # Custom CRS(without authid) by WKT, restored by createFromString
+    windowSetting['crs'] = None if self.crs is None else self.crs.authid() or "WKT:%s" % self.crs.toWkt()
+    source = self.syncGraph.sources.get( self )
+    windowSetting['link'] = 0 if source is None else source.numWin
+    windowSetting['minimized'] = int( self.isMinimized() )
 
     return windowSetting
 
-  def setWindowSetting(self, windowSetting):
+  def setWindowSetting(self, windowSetting, nodesQgis=None):
+    """
+    The render is suspended until releaseRestore(ContainerAuxiliaryWindow),
+    hidden or minimized windows are released when shown.
+    nodesQgis: { layerId: QgsLayerTreeLayer } of main map, shared by restored windows
+    """
     self.numWin = windowSetting['numWin']
+    self._holdRender( 'restore' )
+    self.isActiveRestore = bool( windowSetting.get( 'active', 0 ) )
+
+    if nodesQgis is None:
+      nodesQgis = self.nodesLayerQgis()
 
     # Populate with layers and set Bridge for legend
-    layerIds = windowSetting['layerIds'].split(' ')
-    visibles = map( lambda item: bool( int( item ) ), windowSetting['visibles'].split(' ') )
-    ltg = self.qgisTView.layerTreeModel().rootGroup()
-    for id in range( len( layerIds ) ):
-      node = ltg.findLayer( layerIds[ id ] )
-      if node is None:
-        continue
-      layer = node.layer()
-      visible = Qt.Checked if visibles[ id ] else Qt.Unchecked
-      self._connectVectorRefresh( layer )
-      self.ltg.addLayer( layer ).setVisible( visible )
+    with self.layerTransaction() as ltg:
+      for id, visible in self._layersSetting( windowSetting ):
+        node = nodesQgis.get( id )
+        if node is None:
+          continue
+        layer = node.layer()
+        self._connectVectorRefresh( layer )
+        ltg.addLayer( layer ).setVisible( Qt.Checked if visible else Qt.Unchecked )
     self.dockLegend.setBridge( self.canvas)
     
-    self.show() # Need show before self._connect()
+    # Need show before self._connect()
+    self.showMinimized() if windowSetting.get( 'minimized', 0 ) else self.show()
     self._connect()
-    node = ltg.findLayer( windowSetting['currentLayerId'] )
+    node = self.layerNodes.get( windowSetting['currentLayerId'] )
     if not node is None:
-      layer = node.layer()
-      self.dockLegend.tview.setCurrentLayer( layer )
+      self.dockLegend.tview.setCurrentLayer( node.layer() )
     w = windowSetting['extentCanvas']
     self.canvas.setExtent( QgsRectangle( w['xmin'], w['ymin'], w['xmax'], w['ymax'] ) )
-    for item in ( 'render', 'marker', 'extent' ):
-      value = bool( windowSetting[ item ] )
+    for item in ( 'render', 'marker', 'extent', 'prefetch', 'preview' ):
+      value = bool( windowSetting.get( item, False ) )
       nameGui = "%sCheck" % item
       self.findChild( QCheckBox, nameGui ).setChecked( value )
+    rate = windowSetting.get( 'markerRate', self.marker.rate ) # Projects saved by previous versions not have 'markerRate'
+    if rate in MarkerWindow.rates:
+      self.widgets['markerRateCombo'].setCurrentIndex( MarkerWindow.rates.index( rate ) )
+    idle = windowSetting.get( 'previewIdle', self.previewIdle )
+    if idle in ProgressivePreview.idles:
+      self.widgets['previewIdleCombo'].setCurrentIndex( ProgressivePreview.idles.index( idle ) )
+    self.setScaleFactor( windowSetting.get( 'scaleFactor', 1.0 ) ) # 'link' is restored by container
+    if windowSetting.get( 'crs' ):
+      crs = QgsCoordinateReferenceSystem()
+      if crs.createFromString( windowSetting['crs'] ):
+        self.setCrs( crs )
+    name = windowSetting.get( 'renderProfile', self.renderProfileDefault )
+    w = self.widgets['renderProfileCombo']
+    if w.findText( name ) != -1:
+      w.setCurrentIndex( w.findText( name ) )
+      self._setRenderProfile( name )
+
+  @hotPath('syncMirror')
+  def _syncMirror(self):
+    # Main map changed with guard of graph, the others windows by graph with same generation
+    extent = self._transformToQgis( self.canvas.extent() )
+    if extent is None:
+      return # Outside of CRS of main map
+    self.syncGeneration = self.syncGraph.nextGeneration()
+    self._extentsChanged( self.qgisCanvas, extent )
+    self._textScaleBtnChanched()
+    source = self.syncGraph.sources.get( self )
+    self.setScaleFactor( self.canvas.scale() / ( self.qgisCanvas.scale() * self.syncGraph.factor( source ) ) )
+    self._extent()
+    self.syncGraph.propagate( self, self.qgisCanvas, self.syncGeneration )
+
+  @hotPath('syncQgisCanvas')
+  def _syncQgisCanvas(self, state, generation=None):
+    if not generation is None:
+      if generation < self.syncGeneration:
+        return # Older than the last applied
+      self.syncGeneration = generation
+    extent = state.extent( self.crs )
+    if extent is None:
+      return # Outside of CRS of window
+    scaleFactor = self.syncGraph.factor( self )
+    self._extentsChanged( self.canvas, extent, scaleFactor * state.scale() )
+    self._textScaleBtnChanched( state.scaleText( scaleFactor ) )
+    self._extent( extent )
+    if not self.prefetch is None:
+      self.prefetch.showCached()
+
+  def changeEvent(self, event):
+    super( AuxiliaryWindow, self ).changeEvent( event )
+    if event.type() == QEvent.ActivationChange and self.isActiveWindow():
+      self.timeActivated = time.time()
+      if 'budget' in self.renderHolds: # Focused window has priority
+        self.setRenderBudget( True )
+    if event.type() == QEvent.WindowStateChange and 'restore' in self.renderHolds and self.isReadyRestore():
+      self.releaseRestore()
+    if event.type() in ( QEvent.WindowStateChange, QEvent.ActivationChange ):
+      self._hideSync() if self.isMinimized() else self._catchUpSync()
+
+  def showEvent(self, event):
+    super( AuxiliaryWindow, self ).showEvent( event )
+    QTimer.singleShot( 0, self._catchUpSync ) # After the layout of window
+
+  def hideEvent(self, event):
+    super( AuxiliaryWindow, self ).hideEvent( event )
+    if not event.spontaneous() or self.isMinimized():
+      self._hideSync()
+
+  def moveEvent(self, event):
+    super( AuxiliaryWindow, self ).moveEvent( event )
+    if 'restore' in self.renderHolds and self.isReadyRestore():
+      self.releaseRestore()
+
+  def _teardown(self):
+    """
+    Release the objects and connections of window, the window is deleted by Qt(WA_DeleteOnClose).
+    Need the canvas, the items are removed from its scene.
+    """
+    self.canvas.viewport().removeEventFilter( self )
+    self.scheduler.cancel()
+    self.editRefresh.clear()
+    if not self.dockDiagnostics is None:
+      self.dockDiagnostics.timer.stop()
+    self.marker.remove()
+    if not self.prefetch is None:
+      self.prefetch.close()
+      self.prefetch = None
+    if not self.preview is None:
+      self.preview.close()
+      self.preview = None
+    if not self.extent is None:
+      self.extent.timer.stop()
+      self.canvas.scene().removeItem( self.extent )
+      self.extent = None
+    if self.totalConnections > 0: # Not connected if run failed
+      self._connect( False )
+    self.dockLegend.teardown()
+    self.ltg.addedChildren.disconnect( self.onAddedChildrenLtg )
+    self.ltg.willRemoveChildren.disconnect( self.onWillRemoveChildrenLtg )
+    self.layerNodes.clear()
+
+  def discard(self):
+    """ Window not run(never shown or closed), WA_DeleteOnClose not delete it """
+    self._teardown()
+    self.deleteLater()
+
+  def report(self):
+    """ Layers, connections and estimated memory(bytes) of render caches """
+    size = self.canvas.mapSettings().outputSize()
+    ids = self.layerNodes.keys()
+    totalVisible = len( filter( lambda id: self.layerNodes[ id ].isVisible() != Qt.Unchecked, ids ) )
+    memory = {
+      # Image by visible layer and labels, QgsMapRendererCache not report the size
+      'canvasCache': size.width() * size.height() * 4 * ( totalVisible + 1 ) if self.canvas.isCachingEnabled() else 0,
+      'prefetch': 0 if self.prefetch is None else sum( map( lambda item: item.byteCount(), self.prefetch.tiles.values() ) ),
+      'preview': 0 if self.preview is None or self.preview.image is None else self.preview.image[0].byteCount()
+    }
+    connections = {
+      'window': self.totalConnections,
+      'editLayers': len( self.editRefresh.layers ),
+      'prefetchLayers': 0 if self.prefetch is None else len( self.prefetch.layers )
+    }
+    return {
+      'numWin': self.numWin,
+      'layers': len( ids ),
+      'visibleLayers': totalVisible,
+      'syncGroup': None if self.qgisSyncGroup is None else self.qgisSyncGroup.name(),
+      'renderHolds': sorted( self.renderHolds ),
+      'connections': connections,
+      'memory': memory
+    }
 
   def closeEvent(self, event):
-    self._connect( False )
+    self._teardown()
     event.accept()
     self.closed.emit( self.numWin )
 
@@ -541,20 +2281,34 @@ class AuxiliaryWindow(QMainWindow):
     w = self.findChild( QCheckBox, 'renderCheck')
     if not w.isChecked():
       return
-    self._execFunction(
-      self.canvas.zoomScale, scaleFactor * self.qgisCanvas.scale(),
-      self.canvas.extentsChanged, self.onExtentsChangedMirror
-    )
+    with self.syncGraph.apply( self.canvas ):
+      self.canvas.zoomScale( self.syncGraph.factor( self ) * self.qgisCanvas.scale() )
     self._textScaleBtnChanched()
+    self.syncGraph.propagate( self, self.qgisCanvas ) # Followers
 
   @pyqtSlot()
   def onClickedScale(self):
-    self._execFunction( 
-        self.qgisCanvas.zoomScale, self.canvas.scale(),
-        self.qgisCanvas.extentsChanged, self.onExtentsChangedQgisCanvas
-    )
-    w = self.findChild( QDoubleSpinBox, 'scaleFactorSpin' )
-    self._execFunction( w.setValue, 1.0, w.valueChanged, self.onValueChangedScale )
+    with self.syncGraph.apply( self.qgisCanvas ):
+      self.qgisCanvas.zoomScale( self.canvas.scale() )
+    source = self.syncGraph.sources.get( self )
+    self.setScaleFactor( 1.0 / self.syncGraph.factor( source ) )
+    self.syncGraph.propagate( self, self.qgisCanvas )
+
+  @pyqtSlot( QAction )
+  def onTriggeredCrs(self, action):
+    if action.objectName() == 'crsQgis':
+      self.setCrs()
+      return
+    dlg = QgsGenericProjectionSelector( self )
+    dlg.setMessage( "CRS of window #%d" % self.numWin )
+    crs = self.canvas.mapSettings().destinationCrs()
+    dlg.setSelectedAuthId( crs.authid() )
+    if dlg.exec_() and dlg.selectedAuthId():
+      self.setCrs( QgsCoordinateReferenceSystem( dlg.selectedAuthId() ) )
+
+  @pyqtSlot(int)
+  def onActivatedLink(self, index):
+    self.linkChanged.emit( self.numWin, self.widgets['linkCombo'].itemData( index ) )
 
   @pyqtSlot()
   def onClickedHighlight(self):
@@ -562,127 +2316,194 @@ class AuxiliaryWindow(QMainWindow):
       rb.reset( True )
       self.qgisCanvas.scene().removeItem( rb )
     
+    extent = self._transformToQgis( self.canvas.extent() )
+    if extent is None:
+      return # Outside of CRS of main map
     rb = QgsRubberBand( self.qgisCanvas, QGis.Polygon)
     rb.setBorderColor( QColor( 255,  0, 0 ) )
     rb.setWidth( 2 )
-    rb.setToGeometry( QgsGeometry.fromRect( self.canvas.extent() ), None )
+    rb.setToGeometry( QgsGeometry.fromRect( extent ), None )
     QTimer.singleShot( 2000, removeRB )
 
   @pyqtSlot(bool)
   def onToggledRender(self, enabled):
     if enabled:
       self.canvas.setMapTool(self.toolPan)
-      w = self.findChild( QDoubleSpinBox, 'scaleFactorSpin' )
-      self._extentsChanged( self.canvas, self.onExtentsChangedMirror, self.qgisCanvas, w.value() )
+      scale = self.syncGraph.factor( self ) * self.qgisCanvas.scale()
+      extent = self.qgisExtent()
+      if not extent is None:
+        self._extentsChanged( self.canvas, extent, scale )
       self._textScaleBtnChanched()
       self.canvas.setWheelAction( QgsMapCanvas.WheelZoom )
     else:
+      self.scheduler.cancel()
       self.canvas.unsetMapTool(self.toolPan)
       self.canvas.setWheelAction( QgsMapCanvas.WheelNothing )
-    self.canvas.setRenderFlag( enabled )
+    self._holdRender( 'user', not enabled )
 
   @pyqtSlot(bool)
   def onToggledMarker(self, enabled):
     self.marker.add() if enabled else self.marker.remove() 
 
+  @pyqtSlot(int)
+  def onCurrentIndexChangedMarkerRate(self, index):
+    self.marker.setRate( MarkerWindow.rates[ index ] )
+
   @pyqtSlot(bool)
   def onToggledExtent(self, enabled):
-    def setExtent():
-      if not self.extent is None:
-        self.canvas.scene().removeItem( self.extent )
-      self.extent = QgsRubberBand( self.canvas, QGis.Polygon )
-      self.extent.setBorderColor( QColor( 255, 0 , 0 ) )
-      self.extent.setWidth( 2 )
+    if enabled:
+      if self.extent is None:
+        self.extent = ExtentItem( self.canvas )
+      self.extent.show()
       self._extent()
+    elif not self.extent is None:
+      self.extent.hide()
 
+  @pyqtSlot(bool)
+  def onToggledPrefetch(self, enabled):
     if enabled:
-      setExtent()
-    else:
-      if not self.extent is None:
-        self.canvas.scene().removeItem( self.extent )
-        self.extent = None
+      if self.prefetch is None:
+        self.prefetch = TilePrefetcher( self, self.canvas, self.renderBudget )
+        self.prefetch.prefetch()
+    elif not self.prefetch is None:
+      self.prefetch.close()
+      self.prefetch = None
+
+  @pyqtSlot(bool)
+  def onToggledPreview(self, enabled):
+    if enabled:
+      if self.preview is None:
+        self.preview = ProgressivePreview( self, self.canvas, self._holdRender, self.stats, self.previewIdle )
+    elif not self.preview is None:
+      self.preview.close()
+      self.preview = None
+
+  @pyqtSlot(int)
+  def onCurrentIndexChangedPreviewIdle(self, index):
+    self.previewIdle = ProgressivePreview.idles[ index ]
+    if not self.preview is None:
+      self.preview.setIdle( self.previewIdle )
 
   @pyqtSlot()
-  def onExtentsChangedMirror(self):
-    w = self.findChild( QCheckBox, 'renderCheck')
-    if not w.isChecked():
-      return
-    self._extentsChanged( self.qgisCanvas, self.onExtentsChangedQgisCanvas, self.canvas )
-    self._textScaleBtnChanched()
-    w = self.findChild( QDoubleSpinBox, 'scaleFactorSpin' )
-    self._execFunction(
-        w.setValue, self.canvas.scale() / self.qgisCanvas.scale(),
-        w.valueChanged, self.onValueChangedScale
-    )
-    if not self.extent is None:
-      self._extent()
+  def onRenderStarting(self):
+    if not self.renderTime is None:
+      self.stats.count( 'renderCancelled' ) # Previous render not finished
+    self.stats.count( 'renderStarted' )
+    self.renderTime = time.time()
 
   @pyqtSlot()
-  def onExtentsChangedQgisCanvas(self):
-    w = self.findChild( QCheckBox, 'renderCheck')
-    if not w.isChecked():
-      return
-    w = self.findChild( QDoubleSpinBox, 'scaleFactorSpin' )
-    self._extentsChanged( self.canvas, self.onExtentsChangedMirror, self.qgisCanvas, w.value() )
-    self._textScaleBtnChanched()
-    if not self.extent is None:
-      self._extent()
+  def onMapCanvasRefreshed(self):
+    if not self.renderTime is None:
+      self.stats.addTime( 'render', ( time.time() - self.renderTime ) * 1000.0 )
+      self.renderTime = None
 
   @pyqtSlot()
-  def onDestinationCrsChanged_MapUnitsChanged(self):
+  @hotPath('onExtentsChangedMirror')
+  def onExtentsChangedMirror(self):
+    if self.syncGraph.isApplying( self.canvas ) or not self.widgets['renderCheck'].isChecked():
+      return
+    if not self.prefetch is None:
+      self.prefetch.showCached()
+    # The render of auxiliary canvas is the wanted, the sync is for main map
+    self.scheduler.schedule( self._syncMirror, False )
+
+  @hotPath('onExtentsChangedQgisCanvas')
+  def onExtentsChangedQgisCanvas(self, state, generation=None):
+    if not self.widgets['renderCheck'].isChecked():
+      return
+    if 'hidden' in self.renderHolds or not self.isShown():
+      # Only the flag, the extent of main map is read when shown
+      self.isDirty = True
+      self._hideSync()
+      return
+    if not self.preview is None:
+      self.preview.interact()
+    self.scheduler.schedule( lambda: self._syncQgisCanvas( state, generation ) )
+
+  def onDestinationCrsChanged_MapUnitsChanged(self, crs=None, mapUnits=None):
+    if not self.crs is None:
+      return # Own CRS
+    if crs is None:
+      crs = self.qgisCanvas.mapRenderer().destinationCrs()
+      mapUnits = self.qgisCanvas.mapUnits()
     prevFlag = self.canvas.renderFlag()
     self.canvas.setRenderFlag( False )
 
-    self.canvas.setDestinationCrs( self.qgisCanvas.mapRenderer().destinationCrs()  )
-    self.canvas.setMapUnits( self.qgisCanvas.mapUnits() )
+    self.canvas.setDestinationCrs( crs )
+    self.canvas.setMapUnits( mapUnits )
 
     self.canvas.setRenderFlag( prevFlag )
 
-  @pyqtSlot(bool)
   def onHasCrsTransformEnabledChanged(self, enabled):
+    if not self.crs is None:
+      return # Own CRS, always transformed
     prevFlag = self.canvas.renderFlag()
     self.canvas.setRenderFlag( False )
     self.canvas.mapRenderer().setProjectionsEnabled( enabled )
     self.canvas.setRenderFlag( prevFlag )
 
-  @pyqtSlot(list)
+  @hotPath('onLayersWillBeRemoved')
   def onLayersWillBeRemoved( self, theLayerIds ):
-    ids = list( set( self.ltg.findLayerIds() ) & set( theLayerIds ) ) # intersection
-    nodes = map( lambda item: self.ltg.findLayer( item ), ids )
-    for item in nodes:
-      self._connectVectorRefresh( item.layer(), False )
-      self.ltg.removeChildNode( item )
+    # Only the ids of window(container)
+    if not self.prefetch is None:
+      self.prefetch.removeLayers( theLayerIds )
+    nodes = [ self.layerNodes[ id ] for id in theLayerIds if id in self.layerNodes ]
+    if len( nodes ) == 0:
+      return
+    with self.layerTransaction() as ltg:
+      for item in nodes:
+        self._connectVectorRefresh( item.layer(), False )
+        ltg.removeChildNode( item )
+
+  @pyqtSlot('QgsLayerTreeNode', int, int)
+  def onAddedChildrenLtg(self, node, indexFrom, indexTo):
+    ids = []
+    for item in self._nodesLayer( node, indexFrom, indexTo ):
+      if not item.layerId() in self.layerNodes:
+        ids.append( item.layerId() )
+      self.layerNodes[ item.layerId() ] = item
+    if len( ids ) > 0:
+      self.layerIdsChanged.emit( self.numWin, ids, [] )
+
+  @pyqtSlot('QgsLayerTreeNode', int, int)
+  def onWillRemoveChildrenLtg(self, node, indexFrom, indexTo):
+    ids = []
+    for item in self._nodesLayer( node, indexFrom, indexTo ):
+      # Reorder(legend) adds the new node before remove the old
+      if self.layerNodes.get( item.layerId() ) is item:
+        del self.layerNodes[ item.layerId() ]
+        ids.append( item.layerId() )
+    if len( ids ) > 0:
+      self.layerIdsChanged.emit( self.numWin, [], ids )
 
   @pyqtSlot()
   def onAddSelectedLayersQgis( self ):
     layersQgis = map( lambda item: item.layer(), self.qgisTView.selectedLayerNodes() )
     self._addLayersQgis( layersQgis )
 
-  @pyqtSlot('QgsLayerTreeNode', int, int)
-  def addedChildrenLayer(self, ltg, indexFrom, indexTo):
-    layersQgis = map( lambda item: item.layer(), ltg.findLayers() )
+  @hotPath('addedChildrenLayer')
+  def addedChildrenLayer(self, layersQgis):
     self._addLayersQgis( layersQgis, False )
 
-  @pyqtSlot('QgsLayerTreeNode', int, int)
-  def onRemovedChildrenQgisRoot(self, ltg, indexFrom, indexTo):
-    if not self.qgisSyncGroup is None and not self.qgisSyncGroup in self.root.children():
-      self.qgisSyncGroup = None
-      self.dockLegend.addNameSyncGroup( "None" )
-      msg = "Removed synchronized group (main map)"
-      self.messageBar.pushMessage( msg, QgsMessageBar.INFO, 4 )
-      
-      
+  def removedSyncGroup(self):
+    # Called by container, only for windows with the removed group
+    self.qgisSyncGroup = None
+    self.syncGroupChanged.emit( self.numWin )
+    self.dockLegend.addNameSyncGroup( "None" )
+    msg = "Removed synchronized group (main map)"
+    self._pushMessage( msg, QgsMessageBar.INFO, 4 )
+
   @pyqtSlot()
   def onSyncGroupAddLayersQgis( self):
     
     msg = "Need active a group in main map with new layers"
     ltn = self.qgisTView.currentNode()
     if not isinstance( ltn, QgsLayerTreeGroup ) or ltn == self.root:
-      self.messageBar.pushMessage( msg, QgsMessageBar.WARNING, 3 )
+      self._pushMessage( msg, QgsMessageBar.WARNING, 3 )
       return
 
     if not self._syncGroupAddLayersQgis( ltn ):
-      self.messageBar.pushMessage( msg, QgsMessageBar.WARNING, 3 )
+      self._pushMessage( msg, QgsMessageBar.WARNING, 3 )
 
   @pyqtSlot( 'QgsMapLayer' )
   def onRemoveLayers( self, layer ):
@@ -690,12 +2511,12 @@ class AuxiliaryWindow(QMainWindow):
 
   @pyqtSlot()
   def onNeedSelectLayer(self):
-    self.messageBar.pushMessage("Need select layer(s)", QgsMessageBar.WARNING, 2 )    
+    self._pushMessage("Need select layer(s)", QgsMessageBar.WARNING, 2 )    
 
   @pyqtSlot('QgsMapLayer')
   def onCurrentLayerQgis(self, layer ):
     if layer is None:
-      self.messageBar.pushMessage("Need active layer", QgsMessageBar.WARNING, 2 )
+      self._pushMessage("Need active layer", QgsMessageBar.WARNING, 2 )
     else:
       self.qgisTView.setCurrentLayer( layer )
 
@@ -710,6 +2531,21 @@ class AuxiliaryWindow(QMainWindow):
   def onClosedLegend(self):
     self.actLegend.setText( "Show layers" )
 
+  @pyqtSlot(bool)
+  def onToggledDiagnostics(self, checked):
+    if self.dockDiagnostics is None:
+      self.dockDiagnostics = DiagnosticsDock( self, self.numWin, self.stats )
+      self.addDockWidget( Qt.RightDockWidgetArea, self.dockDiagnostics )
+      # Closed by button of dock
+      self.dockDiagnostics.visibilityChanged.connect( self.onVisibilityChangedDiagnostics )
+    self.dockDiagnostics.setVisible( checked )
+
+  @pyqtSlot(bool)
+  def onVisibilityChangedDiagnostics(self, visible):
+    if not visible and not self.dockDiagnostics.isHidden():
+      return # Other tab of dock area
+    self.actDiagnostics.setChecked( visible )
+
   @pyqtSlot()
   def onActionLegend(self):
     self.actLegend.setText( "" )
@@ -725,26 +2561,227 @@ class ContainerAuxiliaryWindow():
     self.parent = parent
     self.numWin = 0
     self.windows = {}
+    self.qgisCanvas = qgis.utils.iface.mapCanvas()
+    self.syncGroupFeed = SyncGroupFeed()
+    self.restoreStager = RestoreStager( None, self.qgisCanvas )
+    self.renderBudget = RenderBudget( None, self.qgisCanvas )
+    self.traceRecorder = TraceRecorder( None, self.qgisCanvas )
+    self.batchExport = BatchExport( None, self.qgisCanvas )
+    self.batchExport.finished.connect( self.onFinishedExport )
+    self.root = QgsProject.instance().layerTreeRoot()
+    self.layerWindows = {} # Reverse index, layer id: set of windows
+    self.syncGraph = SyncGraph()
+
+  def _connect(self, isConnect = True):
+    signal_slot = (
+      { 'signal': self.qgisCanvas.extentsChanged, 'slot': self.onExtentsChangedQgisCanvas },
+      { 'signal': self.qgisCanvas.xyCoordinates, 'slot': self.onXYCoordinates },
+      { 'signal': self.qgisCanvas.destinationCrsChanged, 'slot': self.onDestinationCrsChanged_MapUnitsChanged },
+      { 'signal': self.qgisCanvas.mapUnitsChanged, 'slot': self.onDestinationCrsChanged_MapUnitsChanged },
+      { 'signal': self.qgisCanvas.hasCrsTransformEnabledChanged, 'slot': self.onHasCrsTransformEnabledChanged },
+      { 'signal': self.root.willRemoveChildren, 'slot': self.onWillRemoveChildrenQgisRoot },
+      { 'signal': QgsMapLayerRegistry.instance().layersWillBeRemoved, 'slot': self.onLayersWillBeRemoved }
+    )
+    if isConnect:
+      for item in signal_slot:
+        item['signal'].connect( item['slot'] )
+    else:
+      for item in signal_slot:
+        item['signal'].disconnect( item['slot'] )
+
+  def _addWindow(self, numWin, win):
+    # Only one connection with main map for all windows
+    if len( self.windows ) == 0:
+      self._connect()
+    self.windows[ numWin ] = win
+    self.renderBudget.add( win )
+    self.traceRecorder.add( win )
+    self.syncGraph.add( win )
+    win.closed.connect( self.onClosed )
+    win.syncGroupChanged.connect( self.onSyncGroupChanged )
+    win.layerIdsChanged.connect( self.onLayerIdsChanged )
+    win.linkChanged.connect( self.onLinkChanged )
+    self.onSyncGroupChanged( numWin )
+    self.onLayerIdsChanged( numWin, win.layerNodes.keys(), [] ) # Layers added before
+    self._updateLinks()
+
+  def _updateLinks(self):
+    for win in self.windows.values():
+      numWins = [ numWin for numWin in sorted( self.windows.keys() )
+                  if self.syncGraph.canFollow( win, self.windows[ numWin ] ) ]
+      source = self.syncGraph.sources.get( win )
+      win.setLinkChoices( numWins, 0 if source is None else source.numWin )
 
   def run(self):
     self.numWin += 1
-    self.windows[ self.numWin ] = AuxiliaryWindow( self.parent, self.parent.geometry(), self.numWin )
-    if not self.windows[ self.numWin ].run():
-      del  self.windows[ self.numWin ]
+    win = AuxiliaryWindow( self.parent, self.parent.geometry(), self.numWin, self.syncGraph, self.renderBudget )
+    if not win.run():
+      win.discard()
       self.numWin -= 1
       msg = "Need selected layers in legend or group with layers."
       msgBar = qgis.utils.iface.messageBar()
       msgBar.pushMessage( self.pluginName, msg, QgsMessageBar.CRITICAL, 4 )
     else:
-      self.windows[ self.numWin ].closed.connect( self.onClosed )
+      self._addWindow( self.numWin, win )
 
   def close(self):
+    self.batchExport.cancel()
     for item in self.windows.keys():
       self.windows[ item ].close()
 
+  def report(self):
+    """ Live windows and shared objects of container """
+    return {
+      'windows': map( lambda item: item.report(), self.windows.values() ),
+      'connectedMainMap': len( self.windows ) > 0,
+      'syncGroups': len( self.syncGroupFeed.windows ),
+      'renderBudget': { 'maxJobs': self.renderBudget.maxJobs, 'queued': len( self.renderBudget.queue ) }
+    }
+
+  def startTrace(self, filename):
+    self.traceRecorder.start( filename, self.windows.values() )
+
+  def stopTrace(self):
+    self.traceRecorder.stop()
+
+  def exportImages(self, directory, dpi=300):
+    msgBar = qgis.utils.iface.messageBar()
+    if len( self.windows ) == 0:
+      msgBar.pushMessage( self.pluginName, "Need auxiliary windows for export", QgsMessageBar.WARNING, 4 )
+      return
+    if not self.batchExport.start( self.windows.values(), directory, dpi ):
+      msgBar.pushMessage( self.pluginName, "Export of windows is running", QgsMessageBar.WARNING, 4 )
+
+  def logReport(self):
+    report = self.report()
+    QgsMessageLog.logMessage( json.dumps( report, indent=2 ), self.pluginName, QgsMessageLog.INFO )
+    memory = 0
+    for item in report['windows']:
+      memory += sum( item['memory'].values() )
+    msg = "%d windows, %d layers, %.1f MB estimated for render caches (report in Log Messages)" % (
+      len( report['windows'] ), sum( map( lambda item: item['layers'], report['windows'] ) ), memory / 1048576.0 )
+    qgis.utils.iface.messageBar().pushMessage( self.pluginName, msg, QgsMessageBar.INFO, 6 )
+
   @pyqtSlot( int )
   def onClosed(self, numWin ):
+    win = self.windows[ numWin ]
+    self.syncGroupFeed.unsubscribe( win )
+    self.restoreStager.remove( win )
+    self.renderBudget.remove( win )
+    self.traceRecorder.remove( win )
+    win.closed.disconnect( self.onClosed )
+    win.syncGroupChanged.disconnect( self.onSyncGroupChanged )
+    win.layerIdsChanged.disconnect( self.onLayerIdsChanged )
+    win.linkChanged.disconnect( self.onLinkChanged )
+    self.syncGraph.remove( win )
+    for id in self.layerWindows.keys():
+      wins = self.layerWindows[ id ]
+      wins.discard( win )
+      if len( wins ) == 0:
+        del self.layerWindows[ id ]
     del self.windows[ numWin ]
+    self._updateLinks()
+    if len( self.windows ) == 0:
+      self._connect( False )
+
+  @pyqtSlot( int )
+  def onSyncGroupChanged(self, numWin):
+    win = self.windows.get( numWin )
+    if win is None: # Window is running, not added
+      return
+    if win.qgisSyncGroup is None:
+      self.syncGroupFeed.unsubscribe( win )
+    else:
+      self.syncGroupFeed.subscribe( win, win.qgisSyncGroup )
+
+  @pyqtSlot( list, float )
+  def onFinishedExport(self, files, seconds):
+    msg = "Exported %d windows in %.1f s -> %s" % ( len( files ), seconds, os.path.dirname( files[0] ) if files else "" )
+    qgis.utils.iface.messageBar().pushMessage( self.pluginName, msg, QgsMessageBar.INFO, 6 )
+
+  @pyqtSlot( int, int )
+  def onLinkChanged(self, numWin, numWinSource):
+    win = self.windows.get( numWin )
+    if win is None:
+      return
+    if self.syncGraph.setSource( win, self.windows.get( numWinSource ) ):
+      self.syncGraph.propagate( None, self.qgisCanvas ) # Only changed windows render
+    self._updateLinks()
+
+  @pyqtSlot( int, list, list )
+  def onLayerIdsChanged(self, numWin, added, removed):
+    win = self.windows.get( numWin )
+    if win is None: # Window is running, not added
+      return
+    for id in added:
+      if not id in self.layerWindows:
+        self.layerWindows[ id ] = set()
+      self.layerWindows[ id ].add( win )
+    for id in removed:
+      wins = self.layerWindows.get( id )
+      if wins is None:
+        continue
+      wins.discard( win )
+      if len( wins ) == 0:
+        del self.layerWindows[ id ]
+
+  @pyqtSlot( list )
+  def onLayersWillBeRemoved(self, theLayerIds):
+    # Only the windows with the layers, each window once
+    idsWindow = {}
+    for id in theLayerIds:
+      for win in self.layerWindows.get( id, () ):
+        idsWindow.setdefault( win, [] ).append( id )
+    for win, ids in idsWindow.items():
+      win.onLayersWillBeRemoved( ids )
+
+  @pyqtSlot('QgsLayerTreeNode', int, int)
+  def onWillRemoveChildrenQgisRoot(self, node, indexFrom, indexTo):
+    # Synchronized groups removed, include the groups inside of removed groups
+    groups = self.syncGroupFeed.windows
+    if len( groups ) == 0:
+      return
+    nodes = node.children()[ indexFrom : indexTo + 1 ]
+    while len( nodes ) > 0:
+      item = nodes.pop()
+      if not isinstance( item, QgsLayerTreeGroup ):
+        continue
+      if item in groups:
+        for win in list( groups[ item ] ):
+          win.removedSyncGroup()
+      nodes.extend( item.children() )
+
+  @pyqtSlot()
+  def onExtentsChangedQgisCanvas(self):
+    if self.syncGraph.isApplying( self.qgisCanvas ):
+      return # Changed by window, propagated by window
+    self.syncGraph.propagate( None, self.qgisCanvas )
+
+  @pyqtSlot( 'QgsPoint' )
+  def onXYCoordinates(self, point):
+    # Windows with own CRS: the marker transforms only the sampled point
+    crsQgis = None
+    for item in self.windows.values():
+      if 'hidden' in item.renderHolds or item.marker.marker is None:
+        continue
+      if item.crs is None:
+        item.marker.onXYCoordinates( point )
+        continue
+      if crsQgis is None:
+        crsQgis = self.qgisCanvas.mapSettings().destinationCrs()
+      item.marker.onXYCoordinates( point, crsQgis, item.crs )
+
+  @pyqtSlot()
+  def onDestinationCrsChanged_MapUnitsChanged(self):
+    crs = self.qgisCanvas.mapRenderer().destinationCrs()
+    mapUnits = self.qgisCanvas.mapUnits()
+    for item in self.windows.values():
+      item.onDestinationCrsChanged_MapUnitsChanged( crs, mapUnits )
+
+  @pyqtSlot( bool )
+  def onHasCrsTransformEnabledChanged(self, enabled):
+    for item in self.windows.values():
+      item.onHasCrsTransformEnabledChanged( enabled )
 
   @pyqtSlot("QDomDocument")
   def onReadProject(self, document):
@@ -754,20 +2791,34 @@ class ContainerAuxiliaryWindow():
       if len( self.windows ) > 0:
         self.close()
       numWin = 0
-      for item in json.loads( value ):
+      nodesQgis = AuxiliaryWindow.nodesLayerQgis()
+      windowsSetting = json.loads( value )
+      for item in windowsSetting:
         w = item['geometryWin']
         geometryWin = QRect ( w['x'], w['y'], w['width'], w['height'] ) 
-        self.windows[ item['numWin' ] ] = AuxiliaryWindow( self.parent, geometryWin, item['numWin' ] )
-        self.windows[ item['numWin' ] ].setWindowSetting( item )
-        self.windows[ item['numWin' ] ].closed.connect( self.onClosed )
+        win = AuxiliaryWindow( self.parent, geometryWin, item['numWin' ], self.syncGraph, self.renderBudget )
+        win.setWindowSetting( item, nodesQgis )
+        self._addWindow( item['numWin' ], win )
         numWin = item['numWin' ] if item['numWin' ]  > numWin else numWin  
       self.numWin = numWin
+      for item in windowsSetting:
+        source = self.windows.get( item.get( 'link', 0 ) ) # Projects saved by previous versions not have 'link'
+        if not source is None:
+          self.syncGraph.setSource( self.windows[ item['numWin'] ], source )
+      self._updateLinks()
+      self.restoreStager.start( self.windows.values() )
 
   @pyqtSlot("QDomDocument")
   def onWriteProject(self, document):
     windowsSetting = []
     for item in self.windows.values():
-      windowsSetting.append( item.getWindowSetting() )
+      windowSetting = item.getWindowSetting()
+      windowSetting['active'] = 0
+      windowsSetting.append( windowSetting )
+    if len( windowsSetting ) > 0:
+      # The last activated window is the first restored
+      times = map( lambda item: item.timeActivated, self.windows.values() )
+      windowsSetting[ times.index( max( times ) ) ]['active'] = 1
 
     proj = QgsProject.instance()
     if len( windowsSetting ) == 0:
@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+Name                 : Auxiliary Window - benchmark
+Description          : Headless timings of synchronization, layers and project
+Date                 : October, 2026
+copyright            : (C) 2015 by Luiz Motta
+email                : motta.luiz@gmail.com
+
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Need a local QGIS install, run without QGIS GUI:
+  QGIS_PREFIX_PATH=/usr python benchmark/bench_auxiliarywindow.py [--json out.json]
+Smoke test(construction and main paths of plugin, exit status 1 if fails):
+  QGIS_PREFIX_PATH=/usr python benchmark/bench_auxiliarywindow.py --smoke
+The Qt platform is 'offscreen', builds of Qt4(without offscreen platform) need a
+virtual display: xvfb-run python benchmark/bench_auxiliarywindow.py
+
+qgis.utils.iface is replaced by IfaceStandIn: main window, map canvas, layer tree
+view and message bar of QGIS, connected as in QGIS application.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import traceback
+
+os.environ.setdefault( 'QT_QPA_PLATFORM', 'offscreen' )
+
+from PyQt4.QtGui import ( QMainWindow, QAction, QIcon )
+from PyQt4.QtCore import ( QCoreApplication, QSize, QRect, QModelIndex )
+
+import qgis.utils
+from qgis.gui import ( QgsMapCanvas, QgsLayerTreeMapCanvasBridge, QgsLayerTreeView, QgsMessageBar )
+from qgis.core import ( QgsApplication, QgsProject, QgsMapLayerRegistry, QgsLayerTreeModel,
+                        QgsVectorLayer, QgsFeature, QgsGeometry, QgsPoint, QgsRectangle,
+                        QgsCoordinateReferenceSystem )
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+
+class IfaceStandIn():
+  """
+  Stand-in for qgis.utils.iface with the objects used by plugin
+  """
+  def __init__(self):
+    self.window = QMainWindow()
+    self.window.setGeometry( QRect( 0, 0, 800, 600 ) )
+    self.canvas = QgsMapCanvas( self.window )
+    self.canvas.resize( QSize( 800, 600 ) )
+    self.window.setCentralWidget( self.canvas )
+    self.root = QgsProject.instance().layerTreeRoot()
+    self.bridge = QgsLayerTreeMapCanvasBridge( self.root, self.canvas )
+    self.model = QgsLayerTreeModel( self.root )
+    self.model.setFlag( QgsLayerTreeModel.AllowNodeChangeVisibility, True )
+    self.view = QgsLayerTreeView( self.window )
+    self.view.setModel( self.model )
+    self.bar = QgsMessageBar( self.window )
+    self.actions = dict( map( lambda name: ( name, QAction( QIcon(), name, self.window ) ),
+                              ( 'show', 'hide', 'remove', 'duplicate' ) ) )
+    self.window.show()
+
+  def mainWindow(self):
+    return self.window
+
+  def mapCanvas(self):
+    return self.canvas
+
+  def layerTreeView(self):
+    return self.view
+
+  def messageBar(self):
+    return self.bar
+
+  def actionShowSelectedLayers(self):
+    return self.actions['show']
+
+  def actionHideSelectedLayers(self):
+    return self.actions['hide']
+
+  def actionRemoveLayer(self):
+    return self.actions['remove']
+
+  def actionDuplicateLayer(self):
+    return self.actions['duplicate']
+
+
+class Benchmark():
+  """
+  Scenarios of plugin, each scenario returns a list of results:
+  { 'scenario', 'parameter', 'count', 'total', 'mean', 'max' }, times in milliseconds
+  """
+  extent = QgsRectangle( -50.0, -20.0, -40.0, -10.0 )
+
+  def __init__(self, iface, timeout=30.0):
+    self.iface = iface
+    self.timeout = timeout
+    self.registry = QgsMapLayerRegistry.instance()
+    self.results = []
+
+  def _wait(self, container):
+    """ Process events until all canvas and timers of windows are idle """
+    canvases = [ self.iface.mapCanvas() ] + map( lambda item: item.canvas, container.windows.values() )
+    t0 = time.time()
+    while time.time() - t0 < self.timeout:
+      QCoreApplication.processEvents()
+      isBusy = any( map( lambda item: item.isDrawing(), canvases ) ) or \
+               any( map( lambda item: item.scheduler.timer.isActive(), container.windows.values() ) ) or \
+               any( map( lambda item: not item.preview is None and item.preview.timer.isActive(),
+                         container.windows.values() ) ) or \
+               container.syncGroupFeed.timer.isActive() or \
+               container.renderBudget.timer.isActive() or len( container.renderBudget.queue ) > 0 or \
+               len( container.restoreStager.queue ) > 0
+      if not isBusy:
+        return
+      time.sleep( 0.001 )
+
+  def _addResult(self, scenario, parameter, times):
+    times = map( lambda item: item * 1000.0, times )
+    result = {
+      'scenario': scenario, 'parameter': parameter, 'count': len( times ),
+      'total': sum( times ), 'mean': sum( times ) / len( times ), 'max': max( times )
+    }
+    self.results.append( result )
+    print( "%-24s %8s %6d %12.2f %10.2f %10.2f" % (
+      scenario, parameter, result['count'], result['total'], result['mean'], result['max'] ) )
+
+  def _layers(self, total, features=100):
+    layers = []
+    for id in range( total ):
+      layer = QgsVectorLayer( "Point?crs=epsg:4326", "bench_%d" % id, "memory" )
+      feats = []
+      for idFeat in range( features ):
+        feat = QgsFeature()
+        x = self.extent.xMinimum() + self.extent.width() * ( idFeat % 10 ) / 10.0
+        y = self.extent.yMinimum() + self.extent.height() * ( idFeat / 10 % 10 ) / 10.0
+        feat.setGeometry( QgsGeometry.fromPoint( QgsPoint( x, y ) ) )
+        feats.append( feat )
+      layer.dataProvider().addFeatures( feats )
+      layers.append( layer )
+    self.registry.addMapLayers( layers, False )
+    return layers
+
+  def _clear(self, container):
+    container.close()
+    QCoreApplication.processEvents()
+    self.registry.removeAllMapLayers()
+    self.iface.root.removeAllChildren()
+    QCoreApplication.processEvents()
+
+  def _container(self, totalWindows, layers):
+    from auxiliarywindow import ContainerAuxiliaryWindow
+    for layer in layers:
+      if self.iface.root.findLayer( layer.id() ) is None:
+        self.iface.root.addLayer( layer )
+    container = ContainerAuxiliaryWindow( self.iface.mainWindow() )
+    self.iface.mapCanvas().setExtent( self.extent )
+    for id in range( totalWindows ):
+      self.iface.layerTreeView().setCurrentLayer( layers[ id % len( layers ) ] )
+      container.run()
+    self._wait( container )
+    return container
+
+  def _check(self, isOk, msg):
+    if not isOk:
+      raise AssertionError( msg )
+
+  def _windows(self, container):
+    return [ container.windows[ numWin ] for numWin in sorted( container.windows.keys() ) ]
+
+  def smoke(self):
+    """ Construction and main paths of plugin, raise AssertionError if fails """
+    from auxiliarywindow import ( HotPathStats, CrsTransforms, TraceRecorder )
+    crsGeo = QgsCoordinateReferenceSystem( 'EPSG:4326' )
+    crsMerc = QgsCoordinateReferenceSystem( 'EPSG:3857' )
+    crsCustom = QgsCoordinateReferenceSystem()
+    crsCustom.createFromProj4( "+proj=merc +lon_0=-45 +datum=WGS84 +units=m +no_defs" )
+
+    # Pieces without canvas
+    stats = HotPathStats()
+    stats.count( 'slot' )
+    stats.addTime( 'slot', 3.0 )
+    self._check( stats.rows() == [ ( 'slot', 1, 3.0, 3.0, 3.0 ) ], "HotPathStats.rows" )
+    transforms = CrsTransforms( 2 )
+    self._check( transforms.get( crsGeo, crsGeo ) is None, "CrsTransforms: same CRS" )
+    transforms.get( crsGeo, crsMerc )
+    transforms.get( crsMerc, crsGeo )
+    transforms.get( crsGeo, crsCustom )
+    self._check( len( transforms.transforms ) == 2 and not ( 'EPSG:4326', 'EPSG:3857' ) in transforms.transforms,
+                 "CrsTransforms: LRU" )
+    rect = transforms.rect( self.extent, crsGeo, crsMerc )
+    self._check( not rect is None and rect.xMinimum() < -5e6, "CrsTransforms.rect" )
+
+    layers = self._layers( 3, 10 )
+    group = self.iface.root.addGroup( "smoke" )
+    group.addLayer( layers[2] )
+    container = self._container( 2, layers[ : 2 ] )
+    canvas = self.iface.mapCanvas()
+    self._check( len( container.windows ) == 2, "ContainerAuxiliaryWindow.run" )
+    win1, win2 = self._windows( container )
+
+    path = TraceRecorder.pathNode( group )
+    self._check( TraceRecorder.nodePath( self.iface.root, path ) is group, "TraceRecorder.nodePath" )
+    self._check( TraceRecorder.itemsNode( group, 0, 0 ) == [ layers[2].id() ], "TraceRecorder.itemsNode" )
+
+    edit = win1.editRefresh
+    edit._setDirty( layers[0], QgsRectangle( 0, 0, 1, 1 ) )
+    edit._setDirty( layers[0], QgsRectangle( 2, 2, 3, 3 ) )
+    self._check( edit.dirty[ layers[0].id() ] == QgsRectangle( 0, 0, 3, 3 ), "EditRefresh._setDirty" )
+    edit._setDirty( layers[0], None )
+    self._check( edit.dirty[ layers[0].id() ] is None, "EditRefresh._setDirty: unknown region" )
+    edit.dirty.clear()
+
+    # Window following window
+    graph = container.syncGraph
+    container.onLinkChanged( win2.numWin, win1.numWin )
+    self._check( graph.sources[ win2 ] is win1, "SyncGraph.setSource" )
+    self._check( not graph.canFollow( win1, win2 ), "SyncGraph.canFollow: cycle" )
+    win1.widgets['scaleFactorSpin'].setValue( 2.0 )
+    win2.widgets['scaleFactorSpin'].setValue( 0.5 )
+    self._check( abs( graph.factor( win2 ) - 1.0 ) < 1e-9, "SyncGraph.factor" )
+
+    # Features of window, own CRS
+    for name in ( 'markerCheck', 'extentCheck', 'prefetchCheck', 'previewCheck' ):
+      win1.widgets[ name ].setChecked( True )
+    win1.setCrs( crsMerc )
+    win2.setCrs( crsCustom )
+    rect = QgsRectangle( self.extent )
+    rect.set( rect.xMinimum() + 1.0, rect.yMinimum(), rect.xMaximum() + 1.0, rect.yMaximum() )
+    canvas.setExtent( rect )
+    self._wait( container )
+    canvas.xyCoordinates.emit( rect.center() )
+    self._wait( container )
+    self._check( win1.canvas.mapSettings().destinationCrs().authid() == 'EPSG:3857', "AuxiliaryWindow.setCrs" )
+    self._check( win1.canvas.extent().xMinimum() < -1e6, "Extent in CRS of window" )
+    win1.onClickedHighlight()
+    win1.widgets['renderCheck'].setChecked( False )
+    win1.widgets['renderCheck'].setChecked( True )
+    self._wait( container )
+
+    # Project
+    container.onWriteProject( None )
+    container.onReadProject( None )
+    self._wait( container )
+    self._check( len( container.windows ) == 2, "onReadProject: windows" )
+    win1, win2 = self._windows( container )
+    self._check( not win1.crs is None and win1.crs.authid() == 'EPSG:3857', "onReadProject: CRS" )
+    self._check( not win2.crs is None and win2.crs.authid() == '', "onReadProject: custom CRS" )
+    self._check( graph.sources.get( win2 ) is win1, "onReadProject: link" )
+
+    # Export and trace
+    directory = tempfile.mkdtemp()
+    files = []
+    container.batchExport.finished.connect( lambda items, seconds: files.extend( items ) )
+    container.exportImages( directory, 96 )
+    t0 = time.time()
+    while container.batchExport.isRunning() and time.time() - t0 < self.timeout:
+      QCoreApplication.processEvents()
+      time.sleep( 0.001 )
+    self._check( len( files ) == 2, "BatchExport: files" )
+    filename = os.path.join( directory, "smoke.trace.gz" )
+    container.startTrace( filename )
+    canvas.setExtent( self.extent )
+    self._wait( container )
+    container.stopTrace()
+    self._check( os.path.getsize( filename ) > 0, "TraceRecorder: file" )
+
+    # Removed layer, run without selected layers(window discarded)
+    self.registry.removeMapLayers( [ layers[0].id() ] )
+    self._wait( container )
+    self._check( not layers[0].id() in win1.layerNodes, "onLayersWillBeRemoved" )
+    self.iface.view.selectionModel().clearSelection()
+    self.iface.view.setCurrentIndex( QModelIndex() )
+    container.run()
+    self._check( len( container.windows ) == 2, "run without selected layers" )
+    report = container.report()
+    self._check( len( report['windows'] ) == 2, "ContainerAuxiliaryWindow.report" )
+
+    self._clear( container )
+    self._check( len( container.windows ) == 0, "ContainerAuxiliaryWindow.close" )
+
+  def extentSync(self, totalWindows, steps=20):
+    layers = self._layers( 4 )
+    container = self._container( totalWindows, layers )
+    canvas = self.iface.mapCanvas()
+    times = []
+    for step in range( steps ):
+      rect = QgsRectangle( self.extent )
+      dx = self.extent.width() * 0.05 * ( step + 1 )
+      rect.set( rect.xMinimum() + dx, rect.yMinimum(), rect.xMaximum() + dx, rect.yMaximum() )
+      t0 = time.time()
+      canvas.setExtent( rect )
+      self._wait( container )
+      times.append( time.time() - t0 )
+    self._addResult( 'extentsChanged', totalWindows, times )
+    self._clear( container )
+
+  def markerThroughput(self, totalWindows, events=2000):
+    layers = self._layers( 1 )
+    container = self._container( totalWindows, layers )
+    for win in container.windows.values():
+      win.widgets['markerCheck'].setChecked( True )
+    canvas = self.iface.mapCanvas()
+    center = self.extent.center()
+    t0 = time.time()
+    for id in range( events ):
+      canvas.xyCoordinates.emit( QgsPoint( center.x() + id * 1e-4, center.y() ) )
+    self._wait( container )
+    self._addResult( 'xyCoordinates', totalWindows, [ ( time.time() - t0 ) / events ] * events )
+    self._clear( container )
+
+  def addLayers(self, totalLayers):
+    layers = self._layers( 1, 10 )
+    container = self._container( 1, layers )
+    win = container.windows.values()[0]
+    newLayers = self._layers( totalLayers, 10 )
+    t0 = time.time()
+    win._addLayersQgis( newLayers )
+    self._wait( container )
+    self._addResult( '_addLayersQgis', totalLayers, [ time.time() - t0 ] )
+    self._clear( container )
+
+  def syncGroup(self, totalLayers):
+    layers = self._layers( 1, 10 )
+    group = self.iface.root.addGroup( "bench_sync" )
+    group.addLayer( layers[0] )
+    container = self._container( 1, layers )
+    win = container.windows.values()[0]
+    win._syncGroupAddLayersQgis( group )
+    newLayers = self._layers( totalLayers, 10 )
+    t0 = time.time()
+    for layer in newLayers: # As a batch of Processing, one by one
+      group.addLayer( layer )
+    self._wait( container )
+    self._addResult( 'syncGroup', totalLayers, [ time.time() - t0 ] )
+    self._clear( container )
+
+  def projectRoundTrip(self, totalWindows, repeat=3):
+    layers = self._layers( 8 )
+    container = self._container( totalWindows, layers )
+    timesWrite, timesRead = [], []
+    for id in range( repeat ):
+      t0 = time.time()
+      container.onWriteProject( None )
+      timesWrite.append( time.time() - t0 )
+      t0 = time.time()
+      container.onReadProject( None )
+      self._wait( container )
+      timesRead.append( time.time() - t0 )
+    self._addResult( 'onWriteProject', totalWindows, timesWrite )
+    self._addResult( 'onReadProject', totalWindows, timesRead )
+    self._clear( container )
+
+
+def main():
+  parser = argparse.ArgumentParser( description="Benchmark of Auxiliary Window plugin" )
+  parser.add_argument( '--windows', default="1,2,4,8,16", help="Total of windows (comma-separated)" )
+  parser.add_argument( '--layers', default="10,100,1000,5000", help="Total of layers (comma-separated)" )
+  parser.add_argument( '--json', default=None, help="File for results" )
+  parser.add_argument( '--smoke', action='store_true', help="Only the smoke test" )
+  args = parser.parse_args()
+  windows = map( int, args.windows.split(',') )
+  layers = map( int, args.layers.split(',') )
+
+  QgsApplication.setPrefixPath( os.environ.get( 'QGIS_PREFIX_PATH', '/usr' ), True )
+  app = QgsApplication( [], True )
+  app.initQgis()
+  qgis.utils.iface = IfaceStandIn()
+
+  bench = Benchmark( qgis.utils.iface )
+  if args.smoke:
+    try:
+      bench.smoke()
+    except Exception:
+      traceback.print_exc()
+      print( "Smoke test: FAILED" )
+      return 1
+    finally:
+      app.exitQgis()
+    print( "Smoke test: OK" )
+    return 0
+
+  print( "%-24s %8s %6s %12s %10s %10s" % ( 'scenario', 'param', 'count', 'total(ms)', 'mean(ms)', 'max(ms)' ) )
+  for total in windows:
+    bench.extentSync( total )
+  for total in windows:
+    bench.markerThroughput( total )
+  for total in layers:
+    bench.addLayers( total )
+  for total in layers:
+    bench.syncGroup( total )
+  for total in windows:
+    bench.projectRoundTrip( total )
+
+  if not args.json is None:
+    with open( args.json, 'w' ) as f:
+      json.dump( bench.results, f, indent=2 )
+
+  app.exitQgis()
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit( main() )
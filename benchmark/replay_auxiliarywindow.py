@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+Name                 : Auxiliary Window - replay
+Description          : Replay of recorded events(trace) with the work of each event
+Date                 : October, 2026
+copyright            : (C) 2015 by Luiz Motta
+email                : motta.luiz@gmail.com
+
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+The trace is recorded by plugin menu 'Record trace of events'. The project of
+trace need be saved with the auxiliary windows, they are restored before replay:
+  QGIS_PREFIX_PATH=/usr python benchmark/replay_auxiliarywindow.py session.trace.gz \
+    --project session.qgs [--realtime] [--json out.json]
+Without --realtime, each event is applied when plugin is idle(as fast as possible).
+The work of event is the difference of counters(diagnostics) of all windows.
+"""
+
+import os
+import sys
+import json
+import gzip
+import time
+import argparse
+
+from bench_auxiliarywindow import ( IfaceStandIn, Benchmark )
+
+from PyQt4.QtCore import ( QCoreApplication, QFileInfo, QSize )
+
+import qgis.utils
+from qgis.core import ( QgsApplication, QgsProject, QgsMapLayerRegistry, QgsLayerTreeGroup,
+                        QgsPoint, QgsRectangle )
+
+
+class Replay():
+  """
+  Apply the events of trace in main map and windows of container.
+  Result by event: { 'count', 'total', 'mean', 'max', 'work': { counter: total } }, times in milliseconds
+  """
+  def __init__(self, iface, container, realtime=False):
+    from auxiliarywindow import TraceRecorder
+    self.trace = TraceRecorder # Paths and items of layer tree
+    self.iface = iface
+    self.container = container
+    self.realtime = realtime
+    self.bench = Benchmark( iface )
+    self.registry = QgsMapLayerRegistry.instance()
+    self.results = {}
+    self.skipped = 0 # Events without layers or nodes(trace of other project)
+
+  def _counters(self):
+    counters = {}
+    for win in self.container.windows.values():
+      for name, value in win.stats.counters.items():
+        counters[ name ] = counters.get( name, 0 ) + value
+      h = win.stats.histograms.get( 'render' )
+      if not h is None:
+        counters['render_ms'] = counters.get( 'render_ms', 0.0 ) + h['total']
+    return counters
+
+  def _addResult(self, event, ms, before, after):
+    result = self.results.get( event )
+    if result is None:
+      result = self.results[ event ] = { 'count': 0, 'total': 0.0, 'max': 0.0, 'work': {} }
+    result['count'] += 1
+    result['total'] += ms
+    result['max'] = max( result['max'], ms )
+    result['mean'] = result['total'] / result['count']
+    for name, value in after.items():
+      delta = value - before.get( name, 0 )
+      if delta != 0:
+        result['work'][ name ] = result['work'].get( name, 0 ) + delta
+
+  def _isSameItems(self, node, indexFrom, items):
+    if node is None or indexFrom + len( items ) > len( node.children() ):
+      return False
+    return self.trace.itemsNode( node, indexFrom, indexFrom + len( items ) - 1 ) == items
+
+  def _apply(self, event, args):
+    canvas = self.iface.mapCanvas()
+    if event == 'extent':
+      canvas.setExtent( QgsRectangle( *args ) )
+    elif event == 'xy':
+      canvas.xyCoordinates.emit( QgsPoint( *args ) )
+    elif event == 'scaleFactor':
+      win = self.container.windows.get( args[0] )
+      if win is None:
+        return False
+      win.widgets['scaleFactorSpin'].setValue( args[1] )
+    elif event == 'treeAdded':
+      path, indexFrom, items = args
+      node = self.trace.nodePath( self.iface.root, path )
+      if not isinstance( node, QgsLayerTreeGroup ):
+        return False
+      for index, item in enumerate( items, indexFrom ):
+        if isinstance( item, list ):
+          group = node.insertGroup( index, item[0] )
+          for layer in filter( None, map( self.registry.mapLayer, item[1] ) ):
+            group.addLayer( layer )
+        else:
+          layer = self.registry.mapLayer( item )
+          if layer is None:
+            return False
+          node.insertLayer( index, layer )
+    elif event == 'treeRemoved':
+      path, indexFrom, items = args
+      node = self.trace.nodePath( self.iface.root, path )
+      # Nodes removed before by registry(layersRemoved recorded first)
+      if not self._isSameItems( node, indexFrom, items ):
+        return False
+      node.removeChildren( indexFrom, len( items ) )
+    elif event == 'layersRemoved':
+      ids = filter( lambda item: not self.registry.mapLayer( item ) is None, args )
+      if len( ids ) == 0:
+        return False
+      self.registry.removeMapLayers( ids )
+    else:
+      return False
+    return True
+
+  def run(self, lines):
+    t0 = time.time()
+    for line in lines:
+      t, event, args = json.loads( line )
+      if self.realtime:
+        while ( time.time() - t0 ) * 1000.0 < t:
+          QCoreApplication.processEvents()
+          time.sleep( 0.001 )
+      before = self._counters()
+      t1 = time.time()
+      if not self._apply( event, args ):
+        self.skipped += 1
+        continue
+      self.bench._wait( self.container )
+      self._addResult( event, ( time.time() - t1 ) * 1000.0, before, self._counters() )
+
+  def printResults(self):
+    print( "%-14s %6s %12s %10s %10s  %s" % ( 'event', 'count', 'total(ms)', 'mean(ms)', 'max(ms)', 'work' ) )
+    for event in sorted( self.results.keys() ):
+      result = self.results[ event ]
+      work = ", ".join( map( lambda item: "%s=%g" % item, sorted( result['work'].items() ) ) )
+      print( "%-14s %6d %12.2f %10.2f %10.2f  %s" % (
+        event, result['count'], result['total'], result['mean'], result['max'], work ) )
+    print( "Skipped events: %d" % self.skipped )
+
+
+def main():
+  parser = argparse.ArgumentParser( description="Replay of trace for Auxiliary Window plugin" )
+  parser.add_argument( 'trace', help="File of trace(.trace.gz)" )
+  parser.add_argument( '--project', required=True, help="Project with the auxiliary windows" )
+  parser.add_argument( '--realtime', action='store_true', help="Events in time of trace" )
+  parser.add_argument( '--json', default=None, help="File for results" )
+  args = parser.parse_args()
+
+  QgsApplication.setPrefixPath( os.environ.get( 'QGIS_PREFIX_PATH', '/usr' ), True )
+  app = QgsApplication( [], True )
+  app.initQgis()
+  qgis.utils.iface = IfaceStandIn()
+
+  from auxiliarywindow import ( ContainerAuxiliaryWindow, TraceRecorder )
+
+  f = gzip.open( args.trace, 'rb' )
+  header = json.loads( f.readline() )
+  if header['version'] != TraceRecorder.version:
+    print( "Version of trace not supported: %s" % header['version'] )
+    return 1
+
+  iface = qgis.utils.iface
+  iface.canvas.resize( QSize( *header['size'] ) )
+  QgsProject.instance().read( QFileInfo( args.project ) )
+  container = ContainerAuxiliaryWindow( iface.mainWindow() )
+  container.onReadProject( None )
+  if len( container.windows ) == 0:
+    print( "Project without auxiliary windows: %s" % args.project )
+    return 1
+  iface.mapCanvas().setExtent( QgsRectangle( *header['extent'] ) )
+  replay = Replay( iface, container, args.realtime )
+  replay.bench._wait( container )
+
+  replay.run( f )
+  f.close()
+  replay.printResults()
+  if not args.json is None:
+    with open( args.json, 'w' ) as out:
+      json.dump( { 'trace': args.trace, 'events': replay.results, 'skipped': replay.skipped }, out, indent=2 )
+
+  container.close()
+  app.exitQgis()
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit( main() )